@@ -1,9 +1,13 @@
 import io from "socket.io-client";
 
 import { Asset } from "@/core/comm/types";
-import { assetStore } from "./store";
+import { assetStore, ImportProgress } from "./store";
 
-export const socket = io(location.protocol + "//" + location.host + "/pa_assetmgmt", { autoConnect: false });
+// The asset manager has its own socket path, so it can be served by a separate asset server process
+export const socket = io(location.protocol + "//" + location.host + "/pa_assetmgmt", {
+    autoConnect: false,
+    path: "/assets/socket.io",
+});
 
 let disConnected = false;
 
@@ -49,3 +53,18 @@ socket.on("Asset.Upload.Finish", (asset: Asset) => {
     assetStore.files.push(asset.id);
     assetStore.resolveUpload(asset.name);
 });
+socket.on("Asset.Upload.Fail", (data: { name: string; reason: string }) => {
+    assetStore.resolveUpload(data.name);
+    window.alert(`Could not upload ${data.name}: ${data.reason}`);
+});
+socket.on("Asset.Import.Progress", (progress: ImportProgress) => {
+    assetStore.setImportProgress(progress);
+});
+socket.on("Asset.Import.Finish", () => {
+    assetStore.setImportProgress(null);
+    socket.emit("Folder.Get", assetStore.currentFolder);
+});
+socket.on("Asset.Import.Fail", (data: { name: string; reason: string }) => {
+    assetStore.setImportProgress(null);
+    window.alert(`Could not import ${data.name}: ${data.reason}`);
+});
@@ -5,6 +5,12 @@ import { Asset } from "@/core/comm/types";
 import { rootStore } from "@/store";
 import { router } from "../router";
 
+export interface ImportProgress {
+    name: string;
+    done: number;
+    total: number;
+}
+
 export interface AssetState {
     root: number;
     files: number[];
@@ -25,6 +31,7 @@ class AssetStore extends VuexModule {
     _pendingUploads: string[] = [];
     _resolvedUploads = 0;
     private _expectedUploads = 0;
+    _importProgress: ImportProgress | null = null;
 
     @Mutation
     clear(): void {
@@ -43,6 +50,11 @@ class AssetStore extends VuexModule {
         this._expectedUploads += number;
     }
 
+    @Mutation
+    setImportProgress(progress: ImportProgress | null): void {
+        this._importProgress = progress;
+    }
+
     @Mutation
     setRoot(root: number): void {
         this.root = root;
@@ -92,6 +104,10 @@ class AssetStore extends VuexModule {
         return this._idMap;
     }
 
+    get importProgress(): ImportProgress | null {
+        return this._importProgress;
+    }
+
     get pendingUploads(): string[] {
         return this._pendingUploads;
     }
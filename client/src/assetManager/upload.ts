@@ -0,0 +1,79 @@
+import { Asset } from "@/core/comm/types";
+import { postFetch } from "@/core/utils";
+
+const CHUNK_SIZE = 1024 * 1024;
+const MAX_RETRIES = 5;
+// Files up to this size are hashed first, so content that is already on the server is not sent again
+const MAX_HASH_SIZE = 64 * 1024 * 1024;
+
+interface UploadStatus {
+    id: string;
+    offset: number;
+    asset?: Asset;
+    import?: boolean;
+}
+
+async function getOffset(id: string): Promise<number> {
+    const response = await fetch(`/api/assets/upload/${id}`);
+    if (!response.ok) throw new Error(response.statusText);
+    return ((await response.json()) as UploadStatus).offset;
+}
+
+async function hashFile(file: File): Promise<string | undefined> {
+    // crypto.subtle is only available in secure contexts
+    if (file.size > MAX_HASH_SIZE || window.crypto?.subtle === undefined) return undefined;
+    const digest = await crypto.subtle.digest("SHA-1", await new Response(file).arrayBuffer());
+    return Array.from(new Uint8Array(digest))
+        .map(b => b.toString(16).padStart(2, "0"))
+        .join("");
+}
+
+// Uploads a file in sequential chunks over http.
+// Every chunk is acknowledged with the new offset, on failure the upload resumes from the server's offset.
+async function sendFile(
+    file: File,
+    data: { directory: number; hash?: string; archive?: boolean },
+): Promise<UploadStatus> {
+    const response = await postFetch("/api/assets/upload", { name: file.name, size: file.size, ...data });
+    if (!response.ok) throw new Error(response.statusText);
+    const created = (await response.json()) as UploadStatus;
+    // The server already has this content
+    if (created.asset !== undefined) return created;
+    const id = created.id;
+
+    let offset = 0;
+    let retries = 0;
+    while (true) {
+        let result: Response | undefined;
+        try {
+            result = await fetch(`/api/assets/upload/${id}`, {
+                method: "PATCH",
+                headers: { "Upload-Offset": offset.toString() },
+                body: file.slice(offset, offset + CHUNK_SIZE),
+            });
+        } catch {
+            result = undefined;
+        }
+        if (result !== undefined && (result.ok || result.status === 409)) {
+            const status = (await result.json()) as UploadStatus;
+            if (status.asset !== undefined || status.import) return status;
+            offset = status.offset;
+            retries = 0;
+            continue;
+        }
+        if (result !== undefined && result.status < 500) throw new Error(result.statusText);
+        if (++retries > MAX_RETRIES) throw new Error("Upload failed");
+        await new Promise(resolve => setTimeout(resolve, 1000 * retries));
+        offset = await getOffset(id);
+    }
+}
+
+export async function uploadFile(file: File, directory: number): Promise<Asset> {
+    const status = await sendFile(file, { directory, hash: await hashFile(file) });
+    return status.asset!;
+}
+
+// The archive is imported in the background, progress is reported over the asset manager socket.
+export async function importArchive(file: File, directory: number): Promise<void> {
+    await sendFile(file, { directory, archive: true });
+}
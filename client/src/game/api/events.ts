@@ -2,7 +2,7 @@ import { AssetList, InvalidationMode, SyncMode } from "@/core/comm/types";
 import "@/game/api/events/access";
 import "@/game/api/events/location";
 import { setLocationOptions } from "@/game/api/events/location";
-import { socket } from "@/game/api/socket";
+import { SESSION_INIT_VERSION, socket } from "@/game/api/socket";
 import { BoardInfo, Note } from "@/game/comm/types/general";
 import { ServerShape } from "@/game/comm/types/shapes";
 import { EventBus } from "@/game/event-bus";
@@ -36,6 +36,16 @@ socket.on("redirect", (destination: string) => {
     console.log("redirecting");
     router.push(destination);
 });
+socket.on("Session.Init", (data: { version: number; events: [string, any][] }) => {
+    if (data.version !== SESSION_INIT_VERSION) {
+        // The server was updated, reload to get a matching client
+        location.reload();
+        return;
+    }
+    for (const [event, payload] of data.events) {
+        for (const listener of socket.listeners(event)) listener(payload);
+    }
+});
 socket.on(
     "Room.Info.Set",
     (data: {
@@ -115,7 +125,7 @@ socket.on("Floor.Remove", removeFloor);
 socket.on("Shape.Add", (shape: ServerShape) => {
     gameManager.addShape(shape);
 });
-socket.on("Shape.Remove", (shape: ServerShape) => {
+function removeShape(shape: ServerShape): void {
     if (!layerManager.UUIDMap.has(shape.uuid)) {
         console.log(`Attempted to remove an unknown shape`);
         return;
@@ -127,6 +137,11 @@ socket.on("Shape.Remove", (shape: ServerShape) => {
     const layer = layerManager.getLayer(shape.floor, shape.layer)!;
     layer.removeShape(layerManager.UUIDMap.get(shape.uuid)!, SyncMode.NO_SYNC);
     layer.invalidate(false);
+}
+socket.on("Shape.Remove", removeShape);
+socket.on("Shape.Add.Fail", (data: { shape: ServerShape; reason: string }) => {
+    removeShape(data.shape);
+    window.alert(`Could not add the shape: ${data.reason}`);
 });
 socket.on("Shape.Order.Set", (data: { shape: ServerShape; index: number }) => {
     if (!layerManager.UUIDMap.has(data.shape.uuid)) {
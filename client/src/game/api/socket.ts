@@ -6,9 +6,12 @@ export const socket = io(location.protocol + "//" + location.host + "/planarally
     transports: ["websocket", "polling"],
 });
 
+// Version of the Session.Init message that bundles all events to join a session
+export const SESSION_INIT_VERSION = 1;
+
 export function createConnection(route: Route): void {
     socket.io.opts.query = `user=${decodeURIComponent(route.params.creator)}&room=${decodeURIComponent(
         route.params.room,
-    )}`;
+    )}&session=${SESSION_INIT_VERSION}`;
     socket.connect();
 }
@@ -0,0 +1,96 @@
+"""
+Admission control for session bootstraps.
+
+A client that connects to a game is sent the room info, its assets, its labels and the full location.
+After a restart every client reconnects at the same moment, so only a few of these bootstraps run at
+once and the others wait for a free slot, while the sessions that already run keep being served.
+Clients that disconnect before their turn are skipped.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from config import config
+
+logger = logging.getLogger("PlanarAllyServer")
+
+MAX_CONCURRENT = config.getint("Connections", "max_concurrent_bootstraps", fallback=2)
+
+# Created on first use, so it belongs to the loop of the running server
+_semaphore: Optional[asyncio.Semaphore] = None
+_waiting: Set[Any] = set()
+_stats: Dict[str, Any] = {
+    "peak_waiting": 0,
+    "completed": 0,
+    "failed": 0,
+    "abandoned": 0,
+    "wait_time": 0.0,
+    "max_wait_time": 0.0,
+    "bootstrap_time": 0.0,
+    # Process time, other work of the loop that runs between the steps of a bootstrap is included
+    "bootstrap_cpu_time": 0.0,
+}
+
+
+async def _admit(
+    sid, bootstrap: Callable[[], Awaitable[None]], connected: Callable[[], bool]
+) -> None:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(MAX_CONCURRENT)
+    _waiting.add(sid)
+    _stats["peak_waiting"] = max(_stats["peak_waiting"], len(_waiting))
+    queued_at = time.perf_counter()
+    try:
+        async with _semaphore:
+            # The client may have left while it was waiting
+            if sid not in _waiting or not connected():
+                _stats["abandoned"] += 1
+                return
+            _waiting.discard(sid)
+            started = time.perf_counter()
+            cpu_started = time.process_time()
+            _stats["wait_time"] += started - queued_at
+            _stats["max_wait_time"] = max(_stats["max_wait_time"], started - queued_at)
+            await bootstrap()
+            _stats["completed"] += 1
+            _stats["bootstrap_time"] += time.perf_counter() - started
+            _stats["bootstrap_cpu_time"] += time.process_time() - cpu_started
+    except Exception:
+        _stats["failed"] += 1
+        logger.exception(f"Bootstrap of {sid} failed")
+    finally:
+        _waiting.discard(sid)
+
+
+def schedule(
+    sid, bootstrap: Callable[[], Awaitable[None]], connected: Callable[[], bool]
+) -> None:
+    """
+    Run bootstrap for sid once a slot is free.
+    It is skipped if `forget(sid)` is called before that or `connected()` is False by then.
+    """
+    asyncio.ensure_future(_admit(sid, bootstrap, connected))
+
+
+def forget(sid) -> None:
+    _waiting.discard(sid)
+
+
+def get_stats() -> Dict[str, Any]:
+    completed = _stats["completed"] or 1
+    return {
+        "max_concurrent": MAX_CONCURRENT,
+        "waiting": len(_waiting),
+        "peak_waiting": _stats["peak_waiting"],
+        "completed": _stats["completed"],
+        "failed": _stats["failed"],
+        "abandoned": _stats["abandoned"],
+        "avg_wait_ms": round(_stats["wait_time"] / completed * 1000, 1),
+        "max_wait_ms": round(_stats["max_wait_time"] * 1000, 1),
+        "avg_bootstrap_ms": round(_stats["bootstrap_time"] / completed * 1000, 1),
+        "avg_bootstrap_cpu_ms": round(
+            _stats["bootstrap_cpu_time"] / completed * 1000, 1
+        ),
+    }
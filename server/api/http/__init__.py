@@ -1,6 +1,8 @@
 from aiohttp import web
 from aiohttp_security import check_authorized
 
+import api.http.admin
+import api.http.assets
 import api.http.auth
 import api.http.rooms
 import api.http.users
@@ -0,0 +1,68 @@
+from aiohttp import web
+from aiohttp_security import check_authorized
+
+import admission
+import backup
+import overload
+import passwords
+import ratelimit
+from config import config
+from models import User
+from state.asset import asset_state
+
+
+def is_admin(user: User) -> bool:
+    admins = config.get("Admin", "users", fallback="")
+    return user.name in {name.strip() for name in admins.split(",") if name.strip()}
+
+
+async def create_snapshot(request: web.Request):
+    user: User = await check_authorized(request)
+    if not is_admin(user):
+        return web.HTTPForbidden()
+    if not backup.SUPPORTED:
+        return web.HTTPNotImplemented(
+            reason="Snapshots of the save file require Python 3.7 or newer"
+        )
+    try:
+        snapshot = await backup.create_snapshot()
+    except backup.BackupFailed as e:
+        return web.HTTPServiceUnavailable(reason=str(e))
+    if snapshot is None:
+        return web.HTTPConflict(reason="A snapshot is already being created")
+    return web.json_response({"snapshot": snapshot.name})
+
+
+async def get_upload_stats(request: web.Request):
+    user: User = await check_authorized(request)
+    if not is_admin(user):
+        return web.HTTPForbidden()
+    return web.json_response(asset_state.uploads.get_stats())
+
+
+async def get_password_stats(request: web.Request):
+    user: User = await check_authorized(request)
+    if not is_admin(user):
+        return web.HTTPForbidden()
+    return web.json_response(passwords.get_stats())
+
+
+async def get_rate_limit_stats(request: web.Request):
+    user: User = await check_authorized(request)
+    if not is_admin(user):
+        return web.HTTPForbidden()
+    return web.json_response(ratelimit.get_stats())
+
+
+async def get_overload_state(request: web.Request):
+    user: User = await check_authorized(request)
+    if not is_admin(user):
+        return web.HTTPForbidden()
+    return web.json_response(overload.state.as_dict())
+
+
+async def get_bootstrap_stats(request: web.Request):
+    user: User = await check_authorized(request)
+    if not is_admin(user):
+        return web.HTTPForbidden()
+    return web.json_response(admission.get_stats())
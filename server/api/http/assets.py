@@ -0,0 +1,385 @@
+import asyncio
+import os
+import re
+
+from aiohttp import hdrs, web
+from aiohttp_security import check_authorized
+
+import asset_gc
+import derivatives
+import imports
+import uploads
+from api.http.admin import get_upload_stats
+from app import logger, sio
+from models import Asset, User
+from models.asset import get_file_size
+from quotas import QuotaExceeded, check_asset_quota
+from state.asset import asset_state
+from uploads import ResumableUpload, UploadRejected, claim_existing
+from utils import get_asset_path
+
+# Upper bound of data that is held in memory while streaming a chunk to or from disk
+READ_SIZE = 256 * 1024
+
+HASH_RE = re.compile(r"[0-9a-f]{40}")
+# Asset files are named after their content hash and thus never change
+ASSET_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Precompressed variants that are served if they exist next to the asset
+ASSET_ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+def _get_upload(request: web.Request, user: User) -> ResumableUpload:
+    upload = asset_state.uploads.get(request.match_info["upload"])
+    if not isinstance(upload, ResumableUpload) or upload.owner != user.id:
+        raise web.HTTPNotFound()
+    return upload
+
+
+async def create_upload(request: web.Request):
+    user: User = await check_authorized(request)
+    data = await request.json()
+    size = data.get("size", None)
+    if not data.get("name", None) or not isinstance(size, int) or size < 0:
+        return web.HTTPBadRequest(reason="Please provide a name and size")
+    archive = bool(data.get("archive", False))
+    if archive and not imports.is_archive(data["name"]):
+        return web.HTTPBadRequest(reason="Only zip and tar archives can be imported")
+
+    directory = Asset.get_or_none(
+        (Asset.id == data.get("directory", None))
+        & (Asset.owner == user)
+        & (Asset.file_hash.is_null())
+    )
+    if directory is None:
+        directory = Asset.get_root_folder(user)
+
+    # Content that is already on the server does not need to be transferred again
+    file_hash = data.get("hash", None)
+    if (
+        not archive
+        and isinstance(file_hash, str)
+        and HASH_RE.fullmatch(file_hash)
+        and claim_existing(file_hash)
+    ):
+        # The declared size is not trusted, the asset is counted with the stored file
+        try:
+            check_asset_quota(user, get_file_size(file_hash))
+        except QuotaExceeded as e:
+            return web.HTTPInsufficientStorage(reason=str(e))
+        asset = Asset.create(
+            name=data["name"], file_hash=file_hash, owner=user, parent=directory
+        )
+        Asset.invalidate_user_structure(user)
+        return web.json_response({"asset": asset.as_dict()})
+
+    # The extracted size of archives is checked once they are unpacked
+    try:
+        check_asset_quota(user, 0 if archive else size)
+    except QuotaExceeded as e:
+        return web.HTTPInsufficientStorage(reason=str(e))
+
+    try:
+        upload = await asset_state.uploads.create_resumable(
+            user.id, data["name"], directory.id, size, archive
+        )
+    except UploadRejected as e:
+        return web.HTTPServiceUnavailable(reason=str(e))
+    return web.json_response({"id": upload.uuid, "offset": 0}, status=201)
+
+
+async def get_upload(request: web.Request):
+    user: User = await check_authorized(request)
+    upload = _get_upload(request, user)
+    return web.json_response({"id": upload.uuid, "offset": upload.offset})
+
+
+async def upload_chunk(request: web.Request):
+    """
+    Append the request body to the upload at the offset given by the Upload-Offset header.
+    The response acknowledges the new offset, once the final byte is received the asset is created.
+    """
+    user: User = await check_authorized(request)
+    upload = _get_upload(request, user)
+
+    try:
+        offset = int(request.headers["Upload-Offset"])
+    except (KeyError, ValueError):
+        return web.HTTPBadRequest(reason="Missing Upload-Offset header")
+    if offset != upload.offset:
+        return web.json_response(
+            {"id": upload.uuid, "offset": upload.offset}, status=409
+        )
+
+    try:
+        async for data in request.content.iter_chunked(READ_SIZE):
+            if offset + len(data) > upload.size:
+                return web.HTTPRequestEntityTooLarge(
+                    max_size=upload.size, actual_size=offset + len(data)
+                )
+            if not await upload.append(offset, data):
+                return web.json_response(
+                    {"id": upload.uuid, "offset": upload.offset}, status=409
+                )
+            offset += len(data)
+    except UploadRejected as e:
+        # Discarded while the data arrived, e.g. because it expired
+        return web.HTTPGone(reason=str(e))
+
+    if not upload.complete:
+        return web.json_response({"id": upload.uuid, "offset": upload.offset})
+
+    # Requests that complete the upload concurrently must not both finish it
+    if not asset_state.uploads.claim(upload):
+        return web.json_response(
+            {"id": upload.uuid, "offset": upload.offset}, status=409
+        )
+
+    if upload.archive:
+        try:
+            path = await asset_state.uploads.take(upload)
+        except UploadRejected as e:
+            return web.HTTPGone(reason=str(e))
+        asyncio.ensure_future(_import_archive(user, upload, path))
+        return web.json_response(
+            {"id": upload.uuid, "offset": upload.offset, "import": True}
+        )
+
+    # The quota was checked against the declared size when the upload was created
+    try:
+        check_asset_quota(user, upload.received_bytes)
+    except QuotaExceeded as e:
+        await asset_state.uploads.discard(upload)
+        return web.HTTPInsufficientStorage(reason=str(e))
+    try:
+        file_hash = await asset_state.uploads.finish(upload)
+    except UploadRejected as e:
+        return web.HTTPGone(reason=str(e))
+    asset = Asset.create(
+        name=upload.name, file_hash=file_hash, owner=user, parent=upload.directory
+    )
+    Asset.invalidate_user_structure(user)
+    return web.json_response(
+        {"id": upload.uuid, "offset": upload.offset, "asset": asset.as_dict()}
+    )
+
+
+async def _import_archive(user: User, upload: ResumableUpload, path):
+    """
+    Import an uploaded archive, progress is reported to the user's asset manager sessions.
+    """
+
+    async def emit(event: str, data):
+        for sid in asset_state.get_sids(id=user.id):
+            await sio.emit(event, data, room=sid, namespace="/pa_assetmgmt")
+
+    async def progress(done: int, total: int):
+        await emit(
+            "Asset.Import.Progress", {"name": upload.name, "done": done, "total": total}
+        )
+
+    try:
+        folder = await imports.import_archive(
+            user, upload.directory, upload.name, path, progress
+        )
+    except UploadRejected as e:
+        await emit("Asset.Import.Fail", {"name": upload.name, "reason": str(e)})
+        return
+    except Exception as e:
+        logger.exception(e)
+        await emit(
+            "Asset.Import.Fail",
+            {"name": upload.name, "reason": "The archive could not be imported."},
+        )
+        return
+    await emit(
+        "Asset.Import.Finish", {"name": upload.name, "folder": folder.as_dict()}
+    )
+
+
+def _read(path: str, start: int, length: int):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(READ_SIZE, length))
+            if not data:
+                return
+            length -= len(data)
+            yield data
+
+
+async def _serve_file(
+    request: web.Request,
+    path: str,
+    etag: str,
+    content_type: str = "application/octet-stream",
+    encodings=ASSET_ENCODINGS,
+):
+    """
+    Serve an immutable file with a strong ETag and range support.
+    Precompressed versions get their own ETag, as a strong validator has to differ per encoding.
+    """
+    headers = {
+        hdrs.CACHE_CONTROL: ASSET_CACHE_CONTROL,
+        hdrs.ACCEPT_RANGES: "bytes",
+    }
+    if encodings:
+        headers[hdrs.VARY] = hdrs.ACCEPT_ENCODING
+
+    loop = asyncio.get_event_loop()
+    if hdrs.RANGE not in request.headers:
+        accept_encoding = request.headers.get(hdrs.ACCEPT_ENCODING, "").lower()
+        for encoding, extension in encodings:
+            if encoding in accept_encoding and await loop.run_in_executor(
+                None, os.path.isfile, path + extension
+            ):
+                path += extension
+                headers[hdrs.CONTENT_ENCODING] = encoding
+                etag = f'{etag[:-1]}-{encoding}"'
+                break
+    headers[hdrs.ETAG] = etag
+
+    if_none_match = request.headers.get(hdrs.IF_NONE_MATCH, "")
+    if if_none_match.strip() == "*" or etag in (
+        tag.strip() for tag in if_none_match.split(",")
+    ):
+        headers.pop(hdrs.CONTENT_ENCODING, None)
+        return web.Response(status=304, headers=headers)
+
+    try:
+        size = (await loop.run_in_executor(None, os.stat, path)).st_size
+    except FileNotFoundError:
+        raise web.HTTPNotFound()
+
+    status = 200
+    start, end = 0, size
+    if hdrs.RANGE in request.headers:
+        try:
+            rng = request.http_range
+        except ValueError:
+            rng = None
+        if rng is not None:
+            start = rng.start if rng.start is not None else 0
+            end = min(rng.stop, size) if rng.stop is not None else size
+            if start < 0:
+                start = max(size + start, 0)
+        if rng is None or start >= end:
+            headers[hdrs.CONTENT_RANGE] = f"bytes */{size}"
+            raise web.HTTPRequestRangeNotSatisfiable(headers=headers)
+        status = 206
+        headers[hdrs.CONTENT_RANGE] = f"bytes {start}-{end - 1}/{size}"
+
+    response = web.StreamResponse(status=status, headers=headers)
+    response.content_type = content_type
+    response.content_length = end - start
+    await response.prepare(request)
+    if request.method != hdrs.METH_HEAD:
+        chunks = _read(path, start, end - start)
+        try:
+            while True:
+                data = await loop.run_in_executor(None, next, chunks, None)
+                if data is None:
+                    break
+                await response.write(data)
+        finally:
+            chunks.close()
+    await response.write_eof()
+    return response
+
+
+async def serve_asset(request: web.Request):
+    """
+    Serve a content addressed asset, these never change and are cached indefinitely.
+    """
+    file_hash = request.match_info["file_hash"]
+    if not HASH_RE.fullmatch(file_hash):
+        raise web.HTTPNotFound()
+    return await _serve_file(request, str(get_asset_path(file_hash)), f'"{file_hash}"')
+
+
+async def serve_asset_variant(request: web.Request):
+    """
+    Serve a downscaled/web optimized variant of an asset, it is generated on first request.
+    Falls back to the original if no smaller variant can be made.
+    """
+    file_hash = request.match_info["file_hash"]
+    variant = request.match_info["variant"]
+    if not HASH_RE.fullmatch(file_hash) or variant not in derivatives.VARIANTS:
+        raise web.HTTPNotFound()
+    path = await derivatives.get_derivative(file_hash, variant)
+    if path is None:
+        return await _serve_file(
+            request, str(get_asset_path(file_hash)), f'"{file_hash}"'
+        )
+    return await _serve_file(
+        request, path, f'"{file_hash}-{variant}"', "image/webp", encodings=()
+    )
+
+
+async def get_asset_tiles(request: web.Request):
+    """
+    Describe the tile pyramid of a large image asset.
+    Responds with 202 while the pyramid is still being built and 404 if the asset is not tiled.
+    """
+    file_hash = request.match_info["file_hash"]
+    if not HASH_RE.fullmatch(file_hash) or not derivatives.TILING_ENABLED:
+        raise web.HTTPNotFound()
+    if not derivatives.has_tiles(file_hash):
+        if not get_asset_path(file_hash).exists():
+            raise web.HTTPNotFound()
+        derivatives.schedule_tiles(file_hash)
+        return web.json_response(
+            {"status": "pending"},
+            status=202,
+            headers={hdrs.CACHE_CONTROL: "no-cache", hdrs.RETRY_AFTER: "2"},
+        )
+    info = await derivatives.get_tiles(file_hash)
+    if info is None:
+        raise web.HTTPNotFound()
+    return web.json_response(info, headers={hdrs.CACHE_CONTROL: ASSET_CACHE_CONTROL})
+
+
+async def serve_asset_tile(request: web.Request):
+    file_hash = request.match_info["file_hash"]
+    if not HASH_RE.fullmatch(file_hash):
+        raise web.HTTPNotFound()
+    level, col, row = (
+        int(request.match_info[k]) for k in ("level", "col", "row")
+    )
+    path = (
+        get_asset_path(file_hash, derivatives.TILES_DIR)
+        / str(level)
+        / f"{col}_{row}.webp"
+    )
+    return await _serve_file(
+        request,
+        str(path),
+        f'"{file_hash}-{level}-{col}-{row}"',
+        "image/webp",
+        encodings=(),
+    )
+
+
+def add_routes(app: web.Application) -> None:
+    """
+    Routes of the asset manager, served by the main server or by the asset server.
+    """
+    # Assets are content addressed and get their own route with immutable caching
+    app.router.add_get(
+        r"/static/assets/{file_hash}/tiles/{level:\d+}/{col:\d+}_{row:\d+}.webp",
+        serve_asset_tile,
+    )
+    app.router.add_get("/static/assets/{file_hash}/tiles", get_asset_tiles)
+    app.router.add_get("/static/assets/{file_hash}/{variant}", serve_asset_variant)
+    app.router.add_get("/static/assets/{file_hash:.+}", serve_asset)
+    app.router.add_post("/api/assets/upload", create_upload)
+    app.router.add_get("/api/assets/upload/{upload}", get_upload)
+    app.router.add_patch("/api/assets/upload/{upload}", upload_chunk)
+    app.router.add_get("/api/admin/uploads", get_upload_stats)
+
+
+def add_background_tasks(app: web.Application) -> None:
+    app.on_startup.append(uploads.start_upload_cleanup)
+    app.on_startup.append(asset_gc.start_asset_gc)
+    app.on_cleanup.append(uploads.stop_upload_cleanup)
+    app.on_cleanup.append(derivatives.stop_derivatives)
+    app.on_cleanup.append(asset_gc.stop_asset_gc)
@@ -1,9 +1,11 @@
 from aiohttp import web
 from aiohttp_security import authorized_userid, forget, remember
 
+import passwords
 from app import logger
 from models import User
 from models.db import db
+from passwords import PasswordQueueFull
 
 
 async def is_authed(request):
@@ -25,7 +27,11 @@ async def login(request):
     username = data["username"]
     password = data["password"]
     u = User.by_name(username)
-    if u is None or not u.check_password(password):
+    try:
+        valid = u is not None and await passwords.check_password(u, password)
+    except PasswordQueueFull as e:
+        return web.HTTPServiceUnavailable(reason=str(e))
+    if not valid:
         return web.HTTPUnauthorized(reason="Username and/or Password do not match")
     response = web.json_response({"email": u.email})
     await remember(request, response, username)
@@ -47,9 +53,14 @@ async def register(request):
     elif not password:
         return web.HTTPBadRequest(reason="Please provide a password")
     else:
+        u = User(name=username)
+        try:
+            await passwords.set_password(u, password)
+        except PasswordQueueFull as e:
+            return web.HTTPServiceUnavailable(reason=str(e))
         with db.atomic():
-            u = User(name=username)
-            u.set_password(password)
+            if User.by_name(username):
+                return web.HTTPConflict(reason="Username already taken")
             u.save()
         response = web.HTTPOk()
         await remember(request, response, username)
@@ -1,7 +1,10 @@
 from aiohttp import web
 from aiohttp_security import check_authorized, forget
 
-from models import User
+import passwords
+from models import Asset, AssetFile, User
+from models.db import db
+from passwords import PasswordQueueFull
 
 
 async def set_email(request: web.Request):
@@ -15,14 +18,20 @@ async def set_email(request: web.Request):
 async def set_password(request: web.Request):
     user: User = await check_authorized(request)
     data = await request.json()
-    user.set_password(data["password"])
+    try:
+        await passwords.set_password(user, data["password"])
+    except PasswordQueueFull as e:
+        return web.HTTPServiceUnavailable(reason=str(e))
     user.save()
     return web.HTTPOk()
 
 
 async def delete_account(request: web.Request):
     user: User = await check_authorized(request)
-    user.delete_instance(recursive=True)
+    with db.atomic():
+        # The assets are removed by the cascade, which bypasses Asset.delete_instance
+        AssetFile.release(Asset.count_files(Asset.owner == user))
+        user.delete_instance(recursive=True)
     response = web.HTTPOk()
     await forget(request, response)
     return response
@@ -1,6 +1,7 @@
 from typing import Any, Dict
 
 import auth
+import overload
 from app import app, logger, sio
 from models import Floor, Layer, LocationUserOption, PlayerRoom
 from models.db import db
@@ -22,7 +23,13 @@ from . import (
 
 
 @sio.on("Client.Options.Set", namespace="/planarally")
-@auth.login_required(app, sio)
+@auth.login_required(
+    app,
+    sio,
+    limit="options",
+    shed=overload.without("locationOptions"),
+    merge=True,
+)
 async def set_client(sid: int, data: Dict[str, Any]):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -48,7 +55,7 @@ async def set_client(sid: int, data: Dict[str, Any]):
 
 
 @sio.on("Client.ActiveLayer.Set", namespace="/planarally")
-@auth.login_required(app, sio)
+@auth.login_required(app, sio, limit="options")
 async def set_layer(sid: int, data: Dict[str, Any]):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -64,7 +71,7 @@ async def set_layer(sid: int, data: Dict[str, Any]):
 
 
 @sio.on("Players.Bring", namespace="/planarally")
-@auth.login_required(app, sio)
+@auth.login_required(app, sio, shed=overload.drop)
 async def bring_players(sid: int, data: Dict[str, Any]):
     pr: PlayerRoom = game_state.get(sid)
 
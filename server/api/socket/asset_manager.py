@@ -1,16 +1,14 @@
-import functools
-import hashlib
-
 from aiohttp import web
 from aiohttp_security import authorized_userid
 
 import auth
 from app import app, logger, sio
 from models import Asset
+from quotas import QuotaExceeded, check_asset_quota
 from state.asset import asset_state
-from utils import FILE_DIR
+from uploads import DEFAULT_CHUNK_SIZE, UploadRejected
+from utils import ASSETS_DIR
 
-ASSETS_DIR = FILE_DIR / "static" / "assets"
 if not ASSETS_DIR.exists():
     ASSETS_DIR.mkdir()
 
@@ -26,6 +24,14 @@ async def assetmgmt_connect(sid: int, environ):
         await sio.emit("Folder.Root.Set", root.id, room=sid, namespace="/pa_assetmgmt")
 
 
+@sio.on("disconnect", namespace="/pa_assetmgmt")
+async def assetmgmt_disconnect(sid: int):
+    if not asset_state.has_sid(sid):
+        return
+
+    await asset_state.remove_sid(sid)
+
+
 @sio.on("Folder.Get", namespace="/pa_assetmgmt")
 async def get_folder(sid: int, folder=None):
     user = asset_state.get_user(sid)
@@ -49,18 +55,10 @@ async def get_folder(sid: int, folder=None):
 async def get_folder_by_path(sid: int, folder):
     user = asset_state.get_user(sid)
 
-    folder = folder.strip("/")
-    target_folder = Asset.get_root_folder(user)
-
-    idPath = []
-
-    if folder:
-        for path in folder.split("/"):
-            try:
-                target_folder = target_folder.get_child(path)
-                idPath.append(target_folder.id)
-            except Asset.DoesNotExist:
-                return await get_folder_by_path(sid, "/")
+    # Unknown paths fall back to the root folder
+    folders = Asset.get_folder_path(user, folder) or []
+    target_folder = folders[-1] if folders else Asset.get_root_folder(user)
+    idPath = [f.id for f in folders]
 
     await sio.emit(
         "Folder.Set",
@@ -78,6 +76,7 @@ async def create_folder(sid: int, data):
     if parent is None:
         parent = Asset.get_root_folder(user)
     asset = Asset.create(name=data["name"], owner=user, parent=parent)
+    Asset.invalidate_user_structure(user)
     await sio.emit(
         "Folder.Create", asset.as_dict(), room=sid, namespace="/pa_assetmgmt"
     )
@@ -97,6 +96,7 @@ async def move_inode(sid: int, data):
         return
     asset.parent = target
     asset.save()
+    Asset.invalidate_user_structure(user)
 
 
 @sio.on("Asset.Rename", namespace="/pa_assetmgmt")
@@ -109,6 +109,7 @@ async def assetmgmt_rename(sid: int, data):
         return
     asset.name = data["name"]
     asset.save()
+    Asset.invalidate_user_structure(user)
 
 
 @sio.on("Asset.Remove", namespace="/pa_assetmgmt")
@@ -119,43 +120,47 @@ async def assetmgmt_rm(sid: int, data):
     if asset.owner != user:
         logger.warning(f"{user.name} attempted to remove a file it doesn't own.")
         return
+    # Files that are no longer used are removed by the asset garbage collector
     asset.delete_instance(recursive=True, delete_nullable=True)
-
-    if asset.file_hash is not None and (ASSETS_DIR / asset.file_hash).exists():
-        if Asset.select().where(Asset.file_hash == asset.file_hash).count() == 0:
-            logger.info(
-                f"No asset maps to file {asset.file_hash}, removing from server"
-            )
-            (ASSETS_DIR / asset.file_hash).unlink()
+    Asset.invalidate_user_structure(user)
 
 
 @sio.on("Asset.Upload", namespace="/pa_assetmgmt")
-@auth.login_required(app, sio)
+@auth.login_required(app, sio, limit="upload")
 async def assetmgmt_upload(sid: int, file_data):
-    uuid = file_data["uuid"]
-
-    if uuid not in asset_state.pending_file_upload_cache:
-        asset_state.pending_file_upload_cache[uuid] = {}
-    asset_state.pending_file_upload_cache[uuid][file_data["slice"]] = file_data
-    if len(asset_state.pending_file_upload_cache[uuid]) != file_data["totalSlices"]:
-        # wait for the rest of the slices
-        return
-
-    # All slices are present
-    data = b""
-    for slice_ in range(file_data["totalSlices"]):
-        data += asset_state.pending_file_upload_cache[uuid][slice_]["data"]
-
-    sh = hashlib.sha1(data)
-    hashname = sh.hexdigest()
-
-    if not (ASSETS_DIR / hashname).exists():
-        with open(ASSETS_DIR / hashname, "wb") as f:
-            f.write(data)
-
-    del asset_state.pending_file_upload_cache[uuid]
-
     user = asset_state.get_user(sid)
+    try:
+        if asset_state.uploads.is_new(file_data["uuid"]):
+            size = file_data.get("size", None)
+            if size is None:
+                # Slices never exceed the chunk size, so this bounds what can be received
+                chunk_size = file_data.get("chunkSize", DEFAULT_CHUNK_SIZE)
+                size = file_data["totalSlices"] * chunk_size
+            try:
+                check_asset_quota(user, size)
+            except QuotaExceeded:
+                asset_state.uploads.reject(file_data["uuid"])
+                raise
+        upload = await asset_state.uploads.add_slice(sid, file_data)
+        if upload is None:
+            # wait for the rest of the slices
+            return
+
+        # All slices are present, the quota was only checked against the declared size
+        try:
+            check_asset_quota(user, upload.received_bytes)
+        except QuotaExceeded:
+            await asset_state.uploads.discard(upload)
+            raise
+        hashname = await asset_state.uploads.finish(upload)
+    except (UploadRejected, QuotaExceeded) as e:
+        await sio.emit(
+            "Asset.Upload.Fail",
+            {"name": file_data["name"], "reason": str(e)},
+            room=sid,
+            namespace="/pa_assetmgmt",
+        )
+        return
 
     asset = Asset.create(
         name=file_data["name"],
@@ -163,6 +168,7 @@ async def assetmgmt_upload(sid: int, file_data):
         owner=user,
         parent=file_data["directory"],
     )
+    Asset.invalidate_user_structure(user)
 
     await sio.emit(
         "Asset.Upload.Finish", asset.as_dict(), room=sid, namespace="/pa_assetmgmt"
@@ -1,13 +1,19 @@
+import asyncio
+from typing import Any, List, Tuple
 from urllib.parse import unquote
 
 from aiohttp_security import authorized_userid
 
-from .location import load_location
+import admission
+from .location import get_location_events
 from app import logger, sio
-from models import Asset, Label, LabelSelection, Location, PlayerRoom, Room, User
+from models import Asset, Label, LabelSelection, PlayerRoom, Room, User
 from models.role import Role
 from state.game import game_state
 
+# Format of the Session.Init message, clients that request another version get the separate events
+SESSION_INIT_VERSION = 1
+
 
 @sio.on("connect", namespace="/planarally")
 async def connect(sid, environ):
@@ -27,83 +33,70 @@ async def connect(sid, environ):
             )
         except IndexError:
             return False
-        else:
-            for pr in room.players:
-                if pr.player == user:
-                    if pr.role != Role.DM and room.is_locked:
-                        return False
-                    break
-            else:
-                return False
-
-        pr = PlayerRoom.get(room=room, player=user)
 
-        # todo: just store PlayerRoom as it has all the info
-        await game_state.add_sid(sid, pr)
+        pr = PlayerRoom.get_or_none(room=room, player=user)
+        if pr is None or (pr.role != Role.DM and room.is_locked):
+            return False
 
         logger.info(f"User {user.name} connected with identifier {sid}")
-
-        labels = Label.select().where((Label.user == user) | (Label.visible == True))
-        label_filters = LabelSelection.select().where(
-            (LabelSelection.user == user) & (LabelSelection.room == room)
+        session_init = ref.get("session", None) == str(SESSION_INIT_VERSION)
+        admission.schedule(
+            sid,
+            lambda: bootstrap(sid, pr.id, session_init),
+            lambda: sio.manager.is_connected(sid, "/planarally"),
         )
 
-        sio.enter_room(sid, pr.active_location.get_path(), namespace="/planarally")
-        await sio.emit("Username.Set", user.name, room=sid, namespace="/planarally")
-        await sio.emit(
-            "Labels.Set",
-            [l.as_dict() for l in labels],
-            room=sid,
-            namespace="/planarally",
-        )
-        await sio.emit(
-            "Labels.Filters.Set",
-            [l.label.uuid for l in label_filters],
-            room=sid,
-            namespace="/planarally",
-        )
-        await sio.emit(
-            "Room.Info.Set",
-            {
-                "name": room.name,
-                "creator": room.creator.name,
-                "invitationCode": str(room.invitation_code),
-                "isLocked": room.is_locked,
-                "default_options": room.default_options.as_dict(),
-                "players": [
-                    {
-                        "id": rp.player.id,
-                        "name": rp.player.name,
-                        "location": rp.active_location.id,
-                    }
-                    for rp in room.players
-                ],
-            },
-            room=sid,
-            namespace="/planarally",
-        )
+
+async def bootstrap(sid, player_room_id: int, session_init: bool):
+    """
+    Send everything a client needs to join its room, scheduled by the admission control.
+    Clients that support it get everything in a single Session.Init message.
+    """
+    # The room may have changed while the client was waiting for its turn
+    pr = PlayerRoom.get_or_none(id=player_room_id)
+    if pr is None or (pr.role != Role.DM and pr.room.is_locked):
+        await sio.disconnect(sid, namespace="/planarally")
+        return
+    user = pr.player
+    room = pr.room
+
+    # todo: just store PlayerRoom as it has all the info
+    await game_state.add_sid(sid, pr)
+    sio.enter_room(sid, pr.active_location.get_path(), namespace="/planarally")
+
+    label_filters = LabelSelection.select(LabelSelection.label).where(
+        (LabelSelection.user == user) & (LabelSelection.room == room)
+    )
+    events: List[Tuple[str, Any]] = [
+        ("Username.Set", user.name),
+        ("Labels.Set", Label.get_for_user(user)),
+        ("Labels.Filters.Set", [l.label_id for l in label_filters]),
+        ("Room.Info.Set", room.get_info()),
+        ("Asset.List.Set", Asset.get_user_structure(user)),
+    ]
+    if pr.role == Role.DM:
+        events.append(("Locations.Settings.Set", room.get_location_settings()))
+    # Building and encoding the location take the longest, running sessions are served in between
+    await asyncio.sleep(0)
+    events.extend(get_location_events(pr, pr.active_location))
+    await asyncio.sleep(0)
+
+    if session_init:
         await sio.emit(
-            "Asset.List.Set",
-            Asset.get_user_structure(user),
+            "Session.Init",
+            {"version": SESSION_INIT_VERSION, "events": events},
             room=sid,
             namespace="/planarally",
         )
-        if pr.role == Role.DM:
-            await sio.emit(
-                "Locations.Settings.Set",
-                {
-                    l.name: {} if l.options is None else l.options.as_dict()
-                    for l in pr.room.locations
-                },
-                room=sid,
-                namespace="/planarally",
-            )
-        await load_location(sid, pr.active_location)
+    else:
+        for event, data in events:
+            await sio.emit(event, data, room=sid, namespace="/planarally")
 
 
 @sio.on("disconnect", namespace="/planarally")
 async def disconnect(sid):
     if not game_state.has_sid(sid):
+        admission.forget(sid)
         return
 
     user = game_state.get_user(sid)
@@ -38,6 +38,7 @@ async def remove_floor(sid, data):
 
     floor: Floor = Floor.get(location=pr.active_location, name=data)
     floor.delete_instance(recursive=True)
+    pr.room.update_shape_count()
 
     await sio.emit(
         "Floor.Remove",
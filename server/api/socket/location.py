@@ -1,10 +1,10 @@
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Tuple
 
 from peewee import JOIN
 from playhouse.shortcuts import update_model_from_dict
 
 import auth
-from .initiative import send_client_initiatives
+from .initiative import get_client_initiatives
 from app import app, logger, sio
 from models import (
     Floor,
@@ -24,13 +24,10 @@ from models.role import Role
 from state.game import game_state
 
 
-@auth.login_required(app, sio)
-async def load_location(sid: int, location: Location):
-    pr: PlayerRoom = game_state.get(sid)
-    if pr.active_location != location:
-        pr.active_location = location
-        pr.save()
-
+def get_location_events(pr: PlayerRoom, location: Location) -> List[Tuple[str, Any]]:
+    """
+    The events that load location on a client of pr, in the order they are handled.
+    """
     data = {}
     data["locations"] = [
         {"id": l.id, "name": l.name} for l in pr.room.locations.order_by(Location.index)
@@ -44,48 +41,47 @@ async def load_location(sid: int, location: Location):
         **LocationUserOption.get(user=pr.player, location=location).as_dict()
     )
 
-    await sio.emit("Board.Set", data, room=sid, namespace="/planarally")
-    await sio.emit(
-        "Location.Set", location.as_dict(), room=sid, namespace="/planarally"
-    )
-    await sio.emit(
-        "Client.Options.Set", client_options, room=sid, namespace="/planarally"
-    )
-    await sio.emit(
-        "Notes.Set",
-        [
-            note.as_dict()
-            for note in Note.select().where(
-                (Note.user == pr.player) & (Note.room == pr.room)
-            )
-        ],
-        room=sid,
-        namespace="/planarally",
-    )
-    await sio.emit(
-        "Markers.Set",
-        [
-            marker.as_string()
-            for marker in Marker.select(Marker.shape_id).where(
-                (Marker.user == pr.player) & (Marker.location == location)
-            )
-        ],
-        room=sid,
-        namespace="/planarally",
-    )
+    events: List[Tuple[str, Any]] = [
+        ("Board.Set", data),
+        ("Location.Set", location.as_dict()),
+        ("Client.Options.Set", client_options),
+        (
+            "Notes.Set",
+            [
+                note.as_dict()
+                for note in Note.select().where(
+                    (Note.user == pr.player) & (Note.room == pr.room)
+                )
+            ],
+        ),
+        (
+            "Markers.Set",
+            [
+                marker.as_string()
+                for marker in Marker.select(Marker.shape_id).where(
+                    (Marker.user == pr.player) & (Marker.location == location)
+                )
+            ],
+        ),
+    ]
 
     location_data = InitiativeLocationData.get_or_none(location=location)
     if location_data:
-        await send_client_initiatives(pr, pr.player)
-        await sio.emit(
-            "Initiative.Round.Update",
-            location_data.round,
-            room=sid,
-            namespace="/planarally",
-        )
-        await sio.emit(
-            "Initiative.Turn.Set", location_data.turn, room=sid, namespace="/planarally"
-        )
+        events.append(("Initiative.Set", get_client_initiatives(pr.player, location)))
+        events.append(("Initiative.Round.Update", location_data.round))
+        events.append(("Initiative.Turn.Set", location_data.turn))
+    return events
+
+
+@auth.login_required(app, sio)
+async def load_location(sid: int, location: Location):
+    pr: PlayerRoom = game_state.get(sid)
+    if pr.active_location != location:
+        pr.active_location = location
+        pr.save()
+
+    for event, data in get_location_events(pr, location):
+        await sio.emit(event, data, room=sid, namespace="/planarally")
 
 
 @sio.on("Location.Change", namespace="/planarally")
@@ -231,3 +227,4 @@ async def delete_location(sid: int, data: int):
 
     location = Location[data]
     location.delete_instance()
+    pr.room.update_shape_count()
@@ -6,6 +6,7 @@ from peewee import Case
 from playhouse.shortcuts import update_model_from_dict
 
 import auth
+import overload
 from . import access
 from app import app, logger, sio
 from models import (
@@ -25,6 +26,7 @@ from models.db import db
 from models.role import Role
 from models.utils import get_table, reduce_data_to_model
 from models.shape.access import has_ownership, has_ownership_temp
+from quotas import QuotaExceeded, check_shape_quota
 from state.game import game_state
 
 
@@ -47,7 +49,18 @@ async def add_shape(sid: int, data: Dict[str, Any]):
     if data["temporary"]:
         game_state.add_temp(sid, data["shape"]["uuid"])
     else:
+        try:
+            check_shape_quota(pr.room)
+        except QuotaExceeded as e:
+            await sio.emit(
+                "Shape.Add.Fail",
+                {"shape": data["shape"], "reason": str(e)},
+                room=sid,
+                namespace="/planarally",
+            )
+            return
         with db.atomic():
+            Room.add_shapes(pr.room.id, 1)
             data["shape"]["layer"] = layer
             data["shape"]["index"] = layer.shapes.count()
             # Shape itself
@@ -87,7 +100,9 @@ async def add_shape(sid: int, data: Dict[str, Any]):
 
 
 @sio.on("Shape.Position.Update", namespace="/planarally")
-@auth.login_required(app, sio)
+@auth.login_required(
+    app, sio, limit="movement", shed=overload.drop_temporary
+)
 async def update_shape_position(sid: str, data: Dict[str, Any]):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -122,7 +137,9 @@ async def update_shape_position(sid: str, data: Dict[str, Any]):
 
 
 @sio.on("Shape.Update", namespace="/planarally")
-@auth.login_required(app, sio)
+@auth.login_required(
+    app, sio, limit="movement", shed=overload.drop_temporary
+)
 async def update_shape(sid: int, data: Dict[str, Any]):
     pr: PlayerRoom = game_state.get(sid)
 
@@ -258,10 +275,12 @@ async def remove_shape(sid: int, data: Dict[str, Any]):
         game_state.remove_temp(sid, data["shape"]["uuid"])
     else:
         old_index = shape.index
-        shape.delete_instance(True)
-        Shape.update(index=Shape.index - 1).where(
-            (Shape.layer == layer) & (Shape.index >= old_index)
-        ).execute()
+        with db.atomic():
+            shape.delete_instance(True)
+            Shape.update(index=Shape.index - 1).where(
+                (Shape.layer == layer) & (Shape.index >= old_index)
+            ).execute()
+            Room.add_shapes(pr.room.id, -1)
 
     if layer.player_visible:
         await sio.emit(
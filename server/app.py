@@ -31,6 +31,11 @@ aiohttp_session.setup(app, EncryptedCookieStorage(auth.get_secret_token()))
 aiohttp_jinja2.setup(app, loader=jinja2.FileSystemLoader("templates"))
 sio.attach(app)
 
+# The asset manager socket has its own path, so a reverse proxy can send it to the asset server process
+ASSET_SOCKET_PATH = "assets/socket.io"
+# Whether the asset manager runs in a separate process, see assetserver.py
+ASSET_SERVER_ENABLED = config.getboolean("AssetServer", "enabled", fallback=False)
+
 # SETUP PATHS
 os.chdir(FILE_DIR)
 
@@ -0,0 +1,171 @@
+"""
+Removal of stored asset files that are no longer referenced by any asset.
+
+Run as a module from the server folder to rebuild the reference counts from the save
+and register stored files that are not used by any asset, e.g. for existing installs:
+    python -m asset_gc
+"""
+import asyncio
+import logging
+import shutil
+import sys
+import time
+from typing import Dict, List, Tuple
+
+from config import config
+from derivatives import DERIVATIVES_DIR, TILES_DIR, VARIANTS
+from peewee import fn
+
+from models import Asset, AssetFile, User
+from models.asset import get_file_size
+from models.db import db
+from utils import ASSETS_DIR, get_asset_path
+
+logger = logging.getLogger("PlanarAllyServer")
+
+# Amount of files removed per transaction
+GC_BATCH = config.getint("Assets", "gc_batch", fallback=100)
+# Seconds a file stays around after its last reference is released
+GC_GRACE = 600
+
+
+def _remove_files(candidates: List[Tuple[str, float]]) -> Tuple[List[str], List[str]]:
+    """
+    Remove the stored files and derivatives of unreferenced file hashes.
+    A file that was written after its last reference was released belongs to a new upload and is kept.
+    Returns the removed and the kept file hashes.
+    """
+    removed: List[str] = []
+    kept: List[str] = []
+    for file_hash, released_at in candidates:
+        path = get_asset_path(file_hash)
+        try:
+            if path.stat().st_mtime > released_at:
+                kept.append(file_hash)
+                continue
+            path.unlink()
+        except FileNotFoundError:
+            pass
+        # precompressed variants
+        for extra in path.parent.glob(f"{file_hash}.*"):
+            extra.unlink()
+        for variant in VARIANTS:
+            derivative = get_asset_path(file_hash, DERIVATIVES_DIR / variant)
+            if derivative.exists():
+                derivative.unlink()
+        shutil.rmtree(get_asset_path(file_hash, TILES_DIR), ignore_errors=True)
+        removed.append(file_hash)
+    return removed, kept
+
+
+async def collect() -> int:
+    """
+    Remove all files whose last reference was released more than GC_GRACE seconds ago.
+    Returns the amount of removed files.
+    """
+    loop = asyncio.get_event_loop()
+    total = 0
+    while True:
+        candidates = list(
+            AssetFile.select(AssetFile.file_hash, AssetFile.released_at)
+            .where(
+                (AssetFile.references <= 0)
+                & (AssetFile.released_at < time.time() - GC_GRACE)
+            )
+            .limit(GC_BATCH)
+            .tuples()
+        )
+        if not candidates:
+            break
+        removed, kept = await loop.run_in_executor(None, _remove_files, candidates)
+        with db.atomic():
+            AssetFile.delete().where(
+                AssetFile.file_hash.in_(removed) & (AssetFile.references <= 0)
+            ).execute()
+            AssetFile.update(released_at=time.time()).where(
+                AssetFile.file_hash.in_(kept) & (AssetFile.references <= 0)
+            ).execute()
+        total += len(removed)
+        if len(candidates) < GC_BATCH:
+            break
+    if total:
+        logger.info(f"Removed {total} unused asset files")
+    return total
+
+
+def reconcile() -> Dict[str, int]:
+    """
+    Rebuild the reference counts and the asset quota usage from the assets in the save.
+    Stored files that no asset refers to are registered without references, so they get collected.
+    """
+    now = time.time()
+    counts = dict(Asset.count_files(Asset.file_hash.is_null(False)))
+    stored = {
+        p.name for p in ASSETS_DIR.glob("??/??/*") if p.is_file() and "." not in p.name
+    }
+    rows = [
+        {
+            "file_hash": file_hash,
+            "references": count,
+            "released_at": None,
+            "size": get_file_size(file_hash),
+        }
+        for file_hash, count in counts.items()
+    ]
+    rows.extend(
+        {"file_hash": file_hash, "references": 0, "released_at": now}
+        for file_hash in stored - counts.keys()
+    )
+    with db.atomic():
+        AssetFile.delete().execute()
+        for i in range(0, len(rows), 500):
+            AssetFile.insert_many(rows[i : i + 500]).execute()
+        # The asset quota usage of every user follows from the rebuilt file sizes
+        User.update(
+            asset_bytes=Asset.select(fn.COALESCE(fn.SUM(AssetFile.size), 0))
+            .join(AssetFile, on=(Asset.file_hash == AssetFile.file_hash))
+            .where(Asset.owner == User.id)
+        ).execute()
+    missing = counts.keys() - stored
+    for file_hash in missing:
+        logger.warning(f"Asset file {file_hash} is used but does not exist")
+    return {
+        "referenced": len(counts),
+        "unreferenced": len(stored - counts.keys()),
+        "missing": len(missing),
+    }
+
+
+async def _gc_loop(interval: int):
+    while True:
+        await asyncio.sleep(interval * 60)
+        try:
+            await collect()
+        except Exception as e:
+            logger.exception(e)
+            logger.error("Failed to remove unused asset files")
+
+
+async def start_asset_gc(app):
+    interval = config.getint("Assets", "gc_interval", fallback=10)
+    if interval > 0:
+        app["asset_gc_task"] = asyncio.ensure_future(_gc_loop(interval))
+
+
+async def stop_asset_gc(app):
+    task = app.get("asset_gc_task", None)
+    if task is not None:
+        task.cancel()
+
+
+if __name__ == "__main__":
+    import save
+
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+    logger.setLevel(logging.INFO)
+    save.check_save()
+    stats = reconcile()
+    logger.info(
+        f"{stats['referenced']} asset files are in use, {stats['unreferenced']} unused files "
+        f"will be removed by the server and {stats['missing']} files are missing"
+    )
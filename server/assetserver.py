@@ -0,0 +1,74 @@
+"""
+PlanarAlly asset server.
+Runs the asset manager (uploads, the asset tree and serving asset files) in a process of its own,
+so large uploads and asset trees do not add latency to the game sessions of the main server.
+
+Set `enabled = true` in the [AssetServer] section of the config, start this next to planarserver.py
+and let the reverse proxy in front of both send the asset routes to this process.
+Logins are shared with the main server through the session cookie secret stored in the save.
+"""
+import os
+import sys
+
+from config import SAVE_FILE
+
+# The main server creates and upgrades the save, the asset server only uses it
+if not os.path.isfile(SAVE_FILE):
+    sys.exit("The save file does not exist, start the main server first.")
+
+import save
+from models import Constants
+
+if Constants.get().save_version != save.SAVE_VERSION:
+    sys.exit("The save file is outdated, start the main server first to upgrade it.")
+
+import asyncio
+import multiprocessing
+
+from aiohttp import web
+
+import api.http.assets
+from state.asset import asset_state
+
+# Force loading of socketio routes
+from api.socket import asset_manager
+from app import ASSET_SERVER_ENABLED, ASSET_SOCKET_PATH, app, logger, sio
+from config import config
+
+# This is a fix for asyncio problems on windows that make it impossible to do ctrl+c
+if sys.platform.startswith("win"):
+
+    def _wakeup():
+        asyncio.get_event_loop().call_later(0.1, _wakeup)
+
+    asyncio.get_event_loop().call_later(0.1, _wakeup)
+
+
+async def on_shutdown(_):
+    for sid in [*asset_state._sid_map.keys()]:
+        await sio.disconnect(sid, namespace="/pa_assetmgmt")
+
+
+sio.attach(app, socketio_path=ASSET_SOCKET_PATH)
+api.http.assets.add_routes(app)
+api.http.assets.add_background_tasks(app)
+app.on_shutdown.append(on_shutdown)
+
+
+if __name__ == "__main__":
+    if not ASSET_SERVER_ENABLED:
+        logger.critical(
+            "THE ASSET SERVER IS NOT ENABLED IN THE [AssetServer] CONFIG SECTION. ABORTING LAUNCH."
+        )
+        sys.exit(2)
+    # Asset derivatives are generated in a process pool
+    multiprocessing.freeze_support()
+    socket = config.get("AssetServer", "socket", fallback=None)
+    if socket:
+        web.run_app(app, path=socket)
+    else:
+        web.run_app(
+            app,
+            host=config.get("AssetServer", "host", fallback="127.0.0.1"),
+            port=config.getint("AssetServer", "port", fallback=8001),
+        )
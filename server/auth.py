@@ -2,6 +2,8 @@ import logging
 from aiohttp_security.abc import AbstractAuthorizationPolicy
 from functools import wraps
 
+import overload
+import ratelimit
 from models import Constants, User
 
 logger = logging.getLogger("PlanarAllyServer")
@@ -13,7 +15,7 @@ class AuthPolicy(AbstractAuthorizationPolicy):
         Return the user_id of the user identified by the identity
         or 'None' if no user exists related to the identity.
         """
-        user = User.by_name(identity)
+        user = User.by_identity(identity)
         if user:
             return user
 
@@ -23,15 +25,18 @@ class AuthPolicy(AbstractAuthorizationPolicy):
         current context, else return False.
         """
         # pylint: disable=unused-argument
-        user = User.by_name(identity)
+        user = User.by_identity(identity)
         if not user:
             return False
         return permission in user.permissions
 
 
-def login_required(app, sio):
+def login_required(app, sio, limit="default", shed=None, merge=False):
     """
     Decorator that restrict access only for authorized users in a websocket context.
+    Events are rate limited per sid with the limits of the `limit` kind, see ratelimit.py.
+    With `merge` the data of events waiting for the rate limit is merged into a single event.
+    While the server is overloaded the event data is passed through `shed` first, see overload.py.
     """
 
     def real_decorator(fn):
@@ -43,7 +48,19 @@ def login_required(app, sio):
             ].has_sid(sid):
                 await sio.emit("redirect", "/")
                 return
-            return await fn(*args, **kwargs)
+            if len(args) > 1:
+                data = overload.filter_event(fn.__name__, shed, args[1])
+                if data is None:
+                    return
+                args = (sid, data, *args[2:])
+            args = await ratelimit.admit(limit, fn.__name__, args, merge)
+            if args is None:
+                return
+            overload.state.pending += 1
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                overload.state.pending -= 1
 
         return wrapped
 
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+
+from config import SAVE_FILE, config
+
+logger = logging.getLogger("PlanarAllyServer")
+
+SNAPSHOT_DIR = Path(config.get("Backups", "directory", fallback="backups"))
+if not SNAPSHOT_DIR.is_absolute():
+    SNAPSHOT_DIR = Path(SAVE_FILE).parent / SNAPSHOT_DIR
+
+# Amount of pages copied per backup step, the save file is only read locked during a step.
+BACKUP_PAGES = config.getint("Backups", "pages_per_step", fallback=256)
+BACKUP_SLEEP = config.getfloat("Backups", "step_sleep", fallback=0.05)
+# Every write by another connection restarts an online backup.
+# After this many restarts the attempt is given up and the backup starts over after a delay.
+BACKUP_MAX_RESTARTS = 5
+BACKUP_ATTEMPTS = 5
+# Seconds to wait before the first retry, doubled for every next one.
+BACKUP_RETRY_DELAY = 1.0
+
+# The online backup api only exists since Python 3.7
+SUPPORTED = hasattr(sqlite3.Connection, "backup")
+
+_snapshot_lock = asyncio.Lock()
+
+
+class _BackupRestarted(Exception):
+    pass
+
+
+class BackupFailed(Exception):
+    pass
+
+
+def backup(target: str, pages: int = BACKUP_PAGES, sleep: float = BACKUP_SLEEP):
+    """
+    Create a consistent copy of the save file at `target` using the sqlite online backup api.
+    The copy is first written to a temporary file and only moved into place once complete.
+
+    The save file is copied a few pages at a time, so writers are never blocked for long.
+    Raises BackupFailed if the save file kept changing during every attempt or could not be copied.
+    """
+    tmp_target = f"{target}.tmp"
+    restarts = 0
+    last_remaining = None
+
+    def progress(status, remaining, total):
+        nonlocal last_remaining, restarts
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts > BACKUP_MAX_RESTARTS:
+                raise _BackupRestarted()
+        last_remaining = remaining
+
+    source = sqlite3.connect(SAVE_FILE)
+    try:
+        destination = sqlite3.connect(tmp_target)
+    except sqlite3.Error as e:
+        source.close()
+        raise BackupFailed(f"Backup could not be created: {e}") from e
+    copied = False
+    error: Optional[sqlite3.Error] = None
+    try:
+        for attempt in range(BACKUP_ATTEMPTS):
+            if attempt > 0:
+                delay = BACKUP_RETRY_DELAY * 2 ** (attempt - 1)
+                logger.warning(
+                    f"Save file keeps changing during backup, retrying in {delay:.0f}s"
+                )
+                time.sleep(delay)
+            restarts = 0
+            last_remaining = None
+            try:
+                source.backup(destination, pages=pages, progress=progress, sleep=sleep)
+                copied = True
+                break
+            except _BackupRestarted:
+                pass
+    except sqlite3.Error as e:
+        error = e
+    finally:
+        destination.close()
+        source.close()
+    if error is not None:
+        os.unlink(tmp_target)
+        raise BackupFailed(f"Save file could not be copied: {error}") from error
+    if not copied:
+        os.unlink(tmp_target)
+        raise BackupFailed(
+            f"Save file kept changing during {BACKUP_ATTEMPTS} backup attempts"
+        )
+    os.replace(tmp_target, target)
+
+
+def get_snapshots() -> List[Path]:
+    if not SNAPSHOT_DIR.exists():
+        return []
+    prefix = f"{Path(SAVE_FILE).name}."
+    return sorted(
+        p
+        for p in SNAPSHOT_DIR.iterdir()
+        if p.name.startswith(prefix) and not p.name.endswith(".tmp")
+    )
+
+
+def apply_retention(keep: int):
+    snapshots = get_snapshots()
+    for snapshot in snapshots[: max(len(snapshots) - keep, 0)]:
+        logger.info(f"Removing old snapshot {snapshot.name}")
+        snapshot.unlink()
+
+
+def _create_snapshot(keep: int) -> Path:
+    SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
+    target = (
+        SNAPSHOT_DIR / f"{Path(SAVE_FILE).name}.{datetime.now():%Y%m%d-%H%M%S}"
+    )
+    start = time.perf_counter()
+    backup(str(target))
+    logger.info(
+        f"Created snapshot {target.name} ({target.stat().st_size} bytes) in {time.perf_counter() - start:.2f}s"
+    )
+    apply_retention(keep)
+    return target
+
+
+async def create_snapshot() -> Optional[Path]:
+    """
+    Take a snapshot of the save file in a background thread.
+    Returns None if another snapshot is still in progress.
+    """
+    if _snapshot_lock.locked():
+        return None
+    async with _snapshot_lock:
+        keep = config.getint("Backups", "keep", fallback=24)
+        return await asyncio.get_event_loop().run_in_executor(
+            None, _create_snapshot, keep
+        )
+
+
+async def _snapshot_loop(interval: int):
+    while True:
+        await asyncio.sleep(interval * 60)
+        try:
+            await create_snapshot()
+        except Exception as e:
+            logger.exception(e)
+            logger.error("Failed to create a snapshot of the save file")
+
+
+async def start_snapshots(app):
+    interval = config.getint("Backups", "interval", fallback=60)
+    if interval > 0 and not SUPPORTED:
+        logger.warning("Snapshots of the save file require Python 3.7 or newer")
+    elif interval > 0:
+        app["snapshot_task"] = asyncio.ensure_future(_snapshot_loop(interval))
+
+
+async def stop_snapshots(app):
+    task = app.get("snapshot_task", None)
+    if task is not None:
+        task.cancel()
@@ -0,0 +1,133 @@
+"""
+Benchmark of the save upgrade process on a generated large save.
+
+Run from the server folder:
+    python -m benchmarks.migrations --shapes 200000 --vertices 100
+
+A save in format 27 is generated in a temporary directory (or --path) and upgraded to the current format.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import config
+
+START_VERSION = 27
+
+
+def generate_save(shapes: int, vertices: int):
+    from models import ALL_MODELS, Constants, Layer, Location, LocationOptions, Room
+    from models import Shape, User
+    from models.db import db
+
+    db.create_tables(ALL_MODELS)
+    Constants.create(save_version=START_VERSION, secret_token=os.urandom(32))
+    with db.atomic():
+        user = User(name="benchmark")
+        user.password_hash = ""
+        user.save()
+        room = Room.create(
+            name="benchmark", creator=user, default_options=LocationOptions.create()
+        )
+        location = Location.create(room=room, name="start", index=1)
+        location.create_floor()
+    layer = Layer.get(name="draw")
+
+    batch = 500
+    for offset in range(0, shapes, batch):
+        uuids = [f"shape-{i}" for i in range(offset, min(offset + batch, shapes))]
+        with db.atomic():
+            Shape.insert_many(
+                [
+                    {
+                        "uuid": uuid,
+                        "layer": layer,
+                        "type_": "polygon",
+                        "x": 0,
+                        "y": 0,
+                        "index": offset + i,
+                    }
+                    for i, uuid in enumerate(uuids)
+                ]
+            ).execute()
+            # Format 27 stores vertices as a json string of {x, y} objects
+            db.cursor().executemany(
+                "INSERT INTO polygon (shape_id, vertices, line_width, open_polygon) VALUES (?, ?, 2, 1)",
+                [
+                    (
+                        uuid,
+                        json.dumps(
+                            [
+                                {
+                                    "x": random.uniform(-1e4, 1e4),
+                                    "y": random.uniform(-1e4, 1e4),
+                                }
+                                for _ in range(vertices)
+                            ]
+                        ),
+                    )
+                    for uuid in uuids
+                ],
+            )
+    db.close()
+
+    conn = sqlite3.connect(config.SAVE_FILE, isolation_level=None)
+    # Format 27 saves do not have materialized asset paths
+    conn.execute('DROP INDEX "asset_owner_id_path"')
+    conn.execute('ALTER TABLE "asset" DROP COLUMN "path"')
+    # Nor asset reference counts and quota usage counters
+    conn.execute('DROP TABLE "asset_file"')
+    conn.execute('ALTER TABLE "user" DROP COLUMN "asset_bytes"')
+    conn.execute('DROP INDEX "user_normalized_name"')
+    conn.execute('ALTER TABLE "user" DROP COLUMN "normalized_name"')
+    conn.execute('ALTER TABLE "room" DROP COLUMN "shape_count"')
+    # Format 27 saves do not use auto vacuum
+    conn.execute("PRAGMA auto_vacuum = NONE")
+    conn.execute("VACUUM")
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--shapes", type=int, default=50_000)
+    parser.add_argument("--vertices", type=int, default=100)
+    parser.add_argument("--path", help="Directory to generate the save in")
+    args = parser.parse_args()
+
+    directory = Path(args.path or tempfile.mkdtemp(prefix="pa-benchmark-"))
+    directory.mkdir(parents=True, exist_ok=True)
+    save_file = directory / "planar.sqlite"
+    if save_file.exists():
+        save_file.unlink()
+    # Must happen before anything imports the save file location
+    config.SAVE_FILE = str(save_file)
+
+    logger = logging.getLogger("PlanarAllyServer")
+    logger.addHandler(logging.StreamHandler(sys.stdout))
+
+    start = time.perf_counter()
+    generate_save(args.shapes, args.vertices)
+    print(
+        f"Generated save with {args.shapes} polygons of {args.vertices} vertices "
+        f"({save_file.stat().st_size / 1e6:.1f} MB) in {time.perf_counter() - start:.2f}s"
+    )
+
+    import save
+
+    start = time.perf_counter()
+    save.check_save()
+    print(
+        f"Upgraded {START_VERSION} -> {save.SAVE_VERSION} in {time.perf_counter() - start:.2f}s "
+        f"({save_file.stat().st_size / 1e6:.1f} MB)"
+    )
+
+
+if __name__ == "__main__":
+    main()
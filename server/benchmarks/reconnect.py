@@ -0,0 +1,283 @@
+"""
+Benchmark of a reconnect storm, e.g. after a server restart.
+
+Run from the server folder:
+    python -m benchmarks.reconnect --clients 200 --shapes 200
+
+A save with one room, a DM and --clients players is generated in a temporary directory (or --path)
+and served by a separate server process. Once the DM is connected, all players connect at the same
+moment. Reported are the time until each player received everything to show the board, the round trip time of the
+DM's session while the players are joining and the time the server spent per bootstrap.
+Clients request a Session.Init message unless --legacy is given.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+import config
+
+PASSWORD = "benchmark"
+# Version of the Session.Init message the benchmark clients request, like the web client does
+SESSION_INIT_VERSION = 1
+# The lowest cost bcrypt allows, logins are not what is measured here
+BCRYPT_ROUNDS = 4
+
+
+def generate_save(clients: int, shapes: int):
+    import save
+    from models import Label, Layer, Location, LocationOptions, PlayerRoom, Room
+    from models import Rect, Shape, User
+    from models.db import db
+    from models.role import Role
+
+    save.check_save()
+    with db.atomic():
+        users = []
+        for i in range(clients + 1):
+            user = User(name=f"user-{i}")
+            user.set_password(PASSWORD, BCRYPT_ROUNDS)
+            user.save()
+            users.append(user)
+            Label.create(
+                uuid=f"label-{i}", user=user, name=f"label {i}", visible=i % 2 == 0
+            )
+        room = Room.create(
+            name="benchmark", creator=users[0], default_options=LocationOptions.create()
+        )
+        location = Location.create(room=room, name="start", index=1)
+        floor = location.create_floor()
+        for i, user in enumerate(users):
+            PlayerRoom.create(
+                player=user,
+                room=room,
+                role=Role.DM if i == 0 else Role.PLAYER,
+                active_location=location,
+            )
+        layer = Layer.get(floor=floor, name="tokens")
+    batch = 500
+    for offset in range(0, shapes, batch):
+        uuids = [f"shape-{i}" for i in range(offset, min(offset + batch, shapes))]
+        with db.atomic():
+            Shape.insert_many(
+                [
+                    {
+                        "uuid": uuid,
+                        "layer": layer,
+                        "type_": "rect",
+                        "x": (offset + i) * 10,
+                        "y": 0,
+                        "index": offset + i,
+                    }
+                    for i, uuid in enumerate(uuids)
+                ]
+            ).execute()
+            Rect.insert_many(
+                [{"shape": uuid, "width": 10, "height": 10} for uuid in uuids]
+            ).execute()
+    Room.add_shapes(room.id, shapes)
+    db.close()
+
+
+def serve(port: int, concurrent: int):
+    """
+    Run the server on the generated save, in the server process.
+    """
+    config.config.set("Passwords", "bcrypt_rounds", str(BCRYPT_ROUNDS))
+    # The DM fetches the bootstrap statistics
+    config.config.set("Admin", "users", "user-0")
+    if concurrent:
+        if not config.config.has_section("Connections"):
+            config.config.add_section("Connections")
+        config.config.set("Connections", "max_concurrent_bootstraps", str(concurrent))
+
+    from aiohttp import web
+
+    import planarserver
+
+    web.run_app(planarserver.app, host="127.0.0.1", port=port, print=None)
+
+
+async def login(base: str, name: str) -> str:
+    import aiohttp
+
+    jar = aiohttp.CookieJar(unsafe=True)
+    async with aiohttp.ClientSession(cookie_jar=jar) as session:
+        response = await session.post(
+            f"{base}/api/login", json={"username": name, "password": PASSWORD}
+        )
+        response.raise_for_status()
+    return "; ".join(f"{c.key}={c.value}" for c in jar)
+
+
+async def join(base: str, cookie: str, legacy: bool):
+    """
+    Connect a client and return it once it received the whole bootstrap, with the time that took.
+    """
+    import socketio
+
+    client = socketio.AsyncClient(reconnection=False)
+    board = asyncio.get_event_loop().create_future()
+    # Markers.Set is the last of the separate events for locations without initiative
+    for event in ("Markers.Set", "Session.Init"):
+        client.on(
+            event,
+            lambda _: board.done() or board.set_result(time.perf_counter()),
+            namespace="/planarally",
+        )
+    query = "user=user-0&room=benchmark"
+    if not legacy:
+        query += f"&session={SESSION_INIT_VERSION}"
+    start = time.perf_counter()
+    await client.connect(
+        f"{base}?{query}",
+        headers={"Cookie": cookie},
+        namespaces=["/planarally"],
+        transports=["websocket"],
+    )
+    return client, await asyncio.wait_for(board, 300) - start
+
+
+async def probe(client, stop: asyncio.Event):
+    """
+    Measure the round trip time of a running session until stop is set.
+    """
+    times = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        await client.call(
+            "Client.Options.Set", {"gridColour": "#000"}, namespace="/planarally"
+        )
+        times.append(time.perf_counter() - start)
+        await asyncio.sleep(0.1)
+    return times
+
+
+def percentile(values, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def summary(values) -> str:
+    ms = [v * 1000 for v in values]
+    return (
+        f"median {statistics.median(ms):.0f}ms, p95 {percentile(ms, 0.95):.0f}ms, "
+        f"max {max(ms):.0f}ms"
+    )
+
+
+async def storm(base: str, clients: int, legacy: bool):
+    names = [f"user-{i}" for i in range(clients + 1)]
+    # One by one, concurrent logins are limited by the password hashing queue
+    cookies = [await login(base, name) for name in names]
+
+    dm, _ = await join(base, cookies[0], legacy)
+    stop = asyncio.Event()
+    probing = asyncio.ensure_future(probe(dm, stop))
+
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *(join(base, cookie, legacy) for cookie in cookies[1:]),
+        return_exceptions=True,
+    )
+    total = time.perf_counter() - start
+    stop.set()
+    round_trips = await probing
+
+    joined = [r for r in results if not isinstance(r, BaseException)]
+    print(f"{len(joined)} of {clients} clients joined in {total:.2f}s")
+    if len(joined) < clients:
+        print(f"Failed: {Counter(type(r).__name__ for r in results if r not in joined)}")
+    if joined:
+        print(f"Time to bootstrap: {summary([t for _, t in joined])}")
+    print(f"DM round trip while joining: {summary(round_trips)}")
+
+    import aiohttp
+
+    async with aiohttp.ClientSession(headers={"Cookie": cookies[0]}) as session:
+        async with session.get(f"{base}/api/admin/bootstraps") as response:
+            stats = await response.json()
+    print(
+        f"Server time per bootstrap: {stats['avg_bootstrap_ms']}ms, "
+        f"of which {stats['avg_bootstrap_cpu_ms']}ms cpu"
+    )
+
+    for client, _ in joined:
+        await client.disconnect()
+    await dm.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--shapes", type=int, default=200)
+    parser.add_argument(
+        "--concurrent",
+        type=int,
+        default=0,
+        help="Bootstraps that run at once, defaults to the server config",
+    )
+    parser.add_argument(
+        "--legacy", action="store_true", help="Request the separate bootstrap events"
+    )
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--path", help="Directory to generate the save in")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    directory = Path(args.path or tempfile.mkdtemp(prefix="pa-benchmark-"))
+    save_file = directory / "planar.sqlite"
+    # Must happen before anything imports the save file location
+    config.SAVE_FILE = str(save_file)
+
+    if args.serve:
+        serve(args.port, args.concurrent)
+        return
+
+    directory.mkdir(parents=True, exist_ok=True)
+    if save_file.exists():
+        save_file.unlink()
+    start = time.perf_counter()
+    generate_save(args.clients, args.shapes)
+    print(
+        f"Generated save with {args.clients} players and {args.shapes} shapes "
+        f"in {time.perf_counter() - start:.2f}s"
+    )
+
+    server = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.reconnect", "--serve"]
+        + ["--path", str(directory), "--port", str(args.port)]
+        + ["--concurrent", str(args.concurrent)],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    base = f"http://127.0.0.1:{args.port}"
+    try:
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(wait_for_server(base))
+        loop.run_until_complete(storm(base, args.clients, args.legacy))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+async def wait_for_server(base: str):
+    import aiohttp
+
+    async with aiohttp.ClientSession() as session:
+        for _ in range(100):
+            try:
+                async with session.get(f"{base}/api/version"):
+                    return
+            except aiohttp.ClientConnectionError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError("The server did not start")
+
+
+if __name__ == "__main__":
+    main()
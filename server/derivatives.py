@@ -0,0 +1,226 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+from config import config
+from utils import ASSETS_DIR, get_asset_path
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+logger = logging.getLogger("PlanarAllyServer")
+
+DERIVATIVES_DIR = ASSETS_DIR / ".derivatives"
+
+# name: (maximum width/height, quality)
+VARIANTS: Dict[str, Tuple[int, int]] = {
+    "thumbnail": (256, 75),
+    "web": (4096, 85),
+}
+
+TILES_DIR = ASSETS_DIR / ".tiles"
+TILE_SIZE = 256
+TILE_QUALITY = 80
+# Only images with a side larger than this get a tile pyramid, 0 disables tiling.
+TILE_THRESHOLD = config.getint("Assets", "tile_threshold", fallback=4096)
+TILING_ENABLED = Image is not None and TILE_THRESHOLD > 0
+
+_executor: Optional[ProcessPoolExecutor] = None
+_pending: Dict[Tuple[str, str], "asyncio.Future[None]"] = {}
+
+
+def _generate(source: str, target: str, max_size: int, quality: int) -> None:
+    """
+    Write a downscaled WebP version of source to target.
+
+    An empty target marks that the original should be used instead,
+    either because it could not be decoded or because it is already smaller.
+    Runs in a worker process.
+    """
+    tmp_target = f"{target}.tmp"
+    try:
+        with Image.open(source) as img:
+            if getattr(img, "is_animated", False):
+                raise ValueError("Animated images are served as is")
+            img.thumbnail((max_size, max_size))
+            if img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGBA")
+            img.save(tmp_target, "WEBP", quality=quality, method=4)
+        if os.path.getsize(tmp_target) >= os.path.getsize(source):
+            os.unlink(tmp_target)
+            raise ValueError("Derivative is not smaller than the original")
+    except Exception:
+        open(tmp_target, "wb").close()
+    os.replace(tmp_target, target)
+
+
+def _generate_tiles(source: str, target: str, threshold: int) -> None:
+    """
+    Cut source into a pyramid of WebP tiles in the target directory.
+
+    Level `levels - 1` is the full resolution image, every lower level halves it
+    until level 0 fits in a single tile. Tiles are stored as <level>/<col>_<row>.webp
+    and the dimensions are written to info.json, which is empty if the image is not tiled.
+    Runs in a worker process.
+    """
+    tmp_target = f"{target}.tmp"
+    shutil.rmtree(tmp_target, ignore_errors=True)
+    os.makedirs(tmp_target)
+    info: Dict[str, Any] = {}
+    try:
+        with Image.open(source) as img:
+            if (
+                not getattr(img, "is_animated", False)
+                and max(img.size) > threshold
+            ):
+                if img.mode not in ("RGB", "RGBA"):
+                    img = img.convert("RGBA")
+                info = {
+                    "width": img.width,
+                    "height": img.height,
+                    "tile_size": TILE_SIZE,
+                    "levels": max(math.ceil(math.log2(max(img.size) / TILE_SIZE)), 0)
+                    + 1,
+                    "format": "webp",
+                }
+                for level in range(info["levels"] - 1, -1, -1):
+                    os.mkdir(os.path.join(tmp_target, str(level)))
+                    for x in range(0, img.width, TILE_SIZE):
+                        for y in range(0, img.height, TILE_SIZE):
+                            tile = img.crop(
+                                (
+                                    x,
+                                    y,
+                                    min(x + TILE_SIZE, img.width),
+                                    min(y + TILE_SIZE, img.height),
+                                )
+                            )
+                            tile.save(
+                                os.path.join(
+                                    tmp_target,
+                                    str(level),
+                                    f"{x // TILE_SIZE}_{y // TILE_SIZE}.webp",
+                                ),
+                                "WEBP",
+                                quality=TILE_QUALITY,
+                            )
+                    if level > 0:
+                        img = img.resize(
+                            (math.ceil(img.width / 2), math.ceil(img.height / 2)),
+                            Image.LANCZOS,
+                        )
+    except Exception:
+        shutil.rmtree(tmp_target)
+        os.makedirs(tmp_target)
+        info = {}
+    with open(os.path.join(tmp_target, "info.json"), "w") as f:
+        if info:
+            json.dump(info, f)
+    shutil.rmtree(target, ignore_errors=True)
+    os.rename(tmp_target, target)
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=config.getint("Assets", "derivative_workers", fallback=2)
+        )
+    return _executor
+
+
+async def get_derivative(file_hash: str, variant: str) -> Optional[str]:
+    """
+    Return the path of the requested variant of an asset, generating it if needed.
+    Returns None if the original file should be served instead.
+    """
+    if Image is None:
+        return None
+
+    target = get_asset_path(file_hash, DERIVATIVES_DIR / variant)
+    key = (file_hash, variant)
+    if not target.exists():
+        if key not in _pending:
+            source = get_asset_path(file_hash)
+            if not source.exists():
+                return None
+            target.parent.mkdir(parents=True, exist_ok=True)
+            max_size, quality = VARIANTS[variant]
+            future = asyncio.get_event_loop().run_in_executor(
+                get_executor(), _generate, str(source), str(target), max_size, quality
+            )
+            future.add_done_callback(lambda _: _pending.pop(key, None))
+            _pending[key] = future
+        try:
+            await asyncio.shield(_pending[key])
+        except Exception as e:
+            logger.exception(e)
+            return None
+
+    if target.stat().st_size == 0:
+        return None
+    return str(target)
+
+
+async def get_tiles(file_hash: str) -> Optional[Dict[str, Any]]:
+    """
+    Return the tile pyramid info of an asset, building the pyramid if needed.
+    Returns None if the asset is not tiled.
+    """
+    if not TILING_ENABLED:
+        return None
+
+    target = get_asset_path(file_hash, TILES_DIR)
+    info_file = target / "info.json"
+    key = (file_hash, "tiles")
+    if not info_file.exists():
+        if key not in _pending:
+            source = get_asset_path(file_hash)
+            if not source.exists():
+                return None
+            target.parent.mkdir(parents=True, exist_ok=True)
+            future = asyncio.get_event_loop().run_in_executor(
+                get_executor(),
+                _generate_tiles,
+                str(source),
+                str(target),
+                TILE_THRESHOLD,
+            )
+            future.add_done_callback(lambda _: _pending.pop(key, None))
+            _pending[key] = future
+        try:
+            await asyncio.shield(_pending[key])
+        except Exception as e:
+            logger.exception(e)
+            return None
+
+    with open(info_file) as f:
+        data = f.read()
+    return json.loads(data) if data else None
+
+
+def has_tiles(file_hash: str) -> bool:
+    """
+    Whether the tile pyramid of an asset has been built, or found not to be needed.
+    """
+    return (get_asset_path(file_hash, TILES_DIR) / "info.json").exists()
+
+
+def schedule_tiles(file_hash: str) -> None:
+    """
+    Build the tile pyramid of an asset in the background.
+    """
+    if TILING_ENABLED:
+        asyncio.ensure_future(get_tiles(file_hash))
+
+
+async def stop_derivatives(app):
+    if _executor is not None:
+        _executor.shutdown(wait=False)
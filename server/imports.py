@@ -0,0 +1,268 @@
+"""
+Import of zip and tar archives into the asset manager.
+
+The archive is read front to back into temporary files, which are hashed and moved
+into the asset store in the process pool. The folders of the archive are then
+created as assets below a new folder named after the archive.
+"""
+import asyncio
+import hashlib
+import logging
+import tarfile
+import uuid
+import zipfile
+from collections import Counter
+from pathlib import Path, PurePosixPath
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from peewee import fn
+
+import derivatives
+from config import config
+from models import Asset, AssetFile, User
+from models.db import db
+from quotas import QuotaExceeded, check_asset_quota
+from uploads import UPLOAD_DIR, UploadRejected, store_file
+
+logger = logging.getLogger("PlanarAllyServer")
+
+ARCHIVE_EXTENSIONS = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+# Limits on the extracted content of a single archive
+MAX_IMPORT_FILES = config.getint("Uploads", "max_import_files", fallback=10000)
+MAX_IMPORT_SIZE = config.getint("Uploads", "max_import_mb", fallback=2048) * 1024 * 1024
+# Keeps the amount of sql variables per insert below sqlite's limit
+INSERT_BATCH = 100
+READ_SIZE = 1024 * 1024
+
+ArchivePath = Tuple[str, ...]
+
+
+def is_archive(name: str) -> bool:
+    return name.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def get_folder_name(name: str) -> str:
+    for extension in ARCHIVE_EXTENSIONS:
+        if name.lower().endswith(extension):
+            return name[: -len(extension)] or name
+    return name
+
+
+def _clean_path(name: str) -> Optional[ArchivePath]:
+    """
+    Split an archive member name into folder and file names.
+    Hidden files and metadata folders are skipped. The names are only used for assets, never on disk.
+    """
+    parts = tuple(
+        part
+        for part in PurePosixPath(name.replace("\\", "/")).parts
+        if part not in ("/", ".", "..")
+    )
+    if not parts or any(p.startswith(".") or p == "__MACOSX" for p in parts):
+        return None
+    return parts
+
+
+def _entries(archive: str):
+    """
+    Yield the name and a file object of every regular file in a zip or tar archive.
+    """
+    if zipfile.is_zipfile(archive):
+        with zipfile.ZipFile(archive) as zf:
+            for info in zf.infolist():
+                if not info.is_dir():
+                    with zf.open(info) as f:
+                        yield info.filename, f
+    else:
+        # Streaming mode, compressed tars are read front to back only once
+        with tarfile.open(archive, mode="r|*") as tf:
+            for info in tf:
+                if info.isfile():
+                    yield info.name, tf.extractfile(info)
+
+
+def _extract(archive: str) -> Tuple[List[Tuple[ArchivePath, Path]], int]:
+    """
+    Extract every file of the archive to a temporary file, runs in a thread.
+    Returns the files and their combined size.
+    """
+    files: List[Tuple[ArchivePath, Path]] = []
+    total_size = 0
+    UPLOAD_DIR.mkdir(exist_ok=True)
+    try:
+        for name, src in _entries(archive):
+            parts = _clean_path(name)
+            if parts is None:
+                continue
+            if len(files) >= MAX_IMPORT_FILES:
+                raise UploadRejected(
+                    f"Archives can contain at most {MAX_IMPORT_FILES} files."
+                )
+            target = UPLOAD_DIR / uuid.uuid4().hex
+            files.append((parts, target))
+            with open(target, "wb") as dst:
+                while True:
+                    data = src.read(READ_SIZE)
+                    if not data:
+                        break
+                    total_size += len(data)
+                    if total_size > MAX_IMPORT_SIZE:
+                        raise UploadRejected(
+                            f"The extracted archive exceeds {MAX_IMPORT_SIZE // (1024 * 1024)}MB."
+                        )
+                    dst.write(data)
+    except (tarfile.TarError, zipfile.BadZipFile, EOFError):
+        _remove([path for _, path in files])
+        raise UploadRejected("This is not a valid zip or tar archive.")
+    except Exception:
+        _remove([path for _, path in files])
+        raise
+    return files, total_size
+
+
+def _remove(paths: List[Path]) -> None:
+    for path in paths:
+        if path.exists():
+            path.unlink()
+
+
+def _hash_and_store(path: str) -> str:
+    """
+    Hash a temporary file and move it into the asset store, runs in a worker process.
+    """
+    sha = hashlib.sha1()
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(READ_SIZE)
+            if not data:
+                break
+            sha.update(data)
+    file_hash = sha.hexdigest()
+    store_file(Path(path), file_hash)
+    return file_hash
+
+
+def _insert(rows: List[Dict]) -> None:
+    for i in range(0, len(rows), INSERT_BATCH):
+        Asset.insert_many(rows[i : i + INSERT_BATCH]).execute()
+
+
+def _create_assets(
+    user: User, directory: int, name: str, files: List[Tuple[ArchivePath, str]]
+) -> Asset:
+    """
+    Mirror the folder structure of the archive below a new folder, one level at a time.
+    """
+    with db.atomic():
+        root = Asset.create(name=name, owner=user, parent=directory)
+        folder_ids: Dict[ArchivePath, int] = {(): root.id}
+        depth = 1
+        while True:
+            folders = sorted(
+                {parts[:depth] for parts, _ in files if len(parts) > depth}
+            )
+            level_files = [(parts, h) for parts, h in files if len(parts) == depth]
+            if not folders and not level_files:
+                break
+            last_id = Asset.select(fn.MAX(Asset.id)).scalar()
+            _insert(
+                [
+                    {
+                        "owner": user,
+                        "parent": folder_ids[folder[:-1]],
+                        "name": folder[-1],
+                        "path": f"{root.path}/{'/'.join(folder)}",
+                    }
+                    for folder in folders
+                ]
+            )
+            # Only this transaction can have added folders since last_id
+            new_folders = {
+                (folder_ids[folder[:-1]], folder[-1]): folder for folder in folders
+            }
+            for asset_id, parent, folder_name in (
+                Asset.select(Asset.id, Asset.parent, Asset.name)
+                .where((Asset.owner == user) & (Asset.id > last_id))
+                .tuples()
+            ):
+                folder_ids[new_folders[(parent, folder_name)]] = asset_id
+            _insert(
+                [
+                    {
+                        "owner": user,
+                        "parent": folder_ids[parts[:-1]],
+                        "name": parts[-1],
+                        "file_hash": file_hash,
+                        "path": f"{root.path}/{'/'.join(parts)}",
+                    }
+                    for parts, file_hash in level_files
+                ]
+            )
+            depth += 1
+        # insert_many bypasses Asset.save, so the files are acquired here
+        counts = list(Counter(h for _, h in files).items())
+        AssetFile.acquire_many(counts)
+        User.add_asset_bytes(user.id, AssetFile.total_size(counts))
+    return root
+
+
+async def import_archive(
+    user: User,
+    directory: int,
+    name: str,
+    archive: Path,
+    progress: Callable[[int, int], Awaitable[None]],
+) -> Asset:
+    """
+    Import an archive into a new folder in directory and return that folder.
+    The archive file is removed afterwards. Raises UploadRejected for invalid or too large archives.
+    """
+    loop = asyncio.get_event_loop()
+    try:
+        files, size = await loop.run_in_executor(None, _extract, str(archive))
+    finally:
+        await loop.run_in_executor(None, _remove, [archive])
+    try:
+        check_asset_quota(user, size)
+    except QuotaExceeded as e:
+        await loop.run_in_executor(None, _remove, [path for _, path in files])
+        raise UploadRejected(str(e))
+
+    total = len(files)
+    await progress(0, total)
+    futures = [
+        loop.run_in_executor(derivatives.get_executor(), _hash_and_store, str(path))
+        for _, path in files
+    ]
+    step = max(1, total // 100)
+    try:
+        for done, future in enumerate(asyncio.as_completed(futures), 1):
+            await future
+            if done % step == 0 or done == total:
+                await progress(done, total)
+
+        hashes = [future.result() for future in futures]
+        paths = [parts for parts, _ in files]
+        # Archives often wrap everything in one folder, which would be nested in the import folder
+        while len({parts[0] for parts in paths}) == 1 and all(
+            len(p) > 1 for p in paths
+        ):
+            paths = [parts[1:] for parts in paths]
+        folder = _create_assets(
+            user, directory, get_folder_name(name), list(zip(paths, hashes))
+        )
+    except Exception:
+        await asyncio.gather(*futures, return_exceptions=True)
+        await loop.run_in_executor(None, _remove, [path for _, path in files])
+        # Files that already moved into the asset store are left to the garbage collector
+        AssetFile.track_unused(
+            future.result()
+            for future in futures
+            if not future.cancelled() and future.exception() is None
+        )
+        raise
+    Asset.invalidate_user_structure(user)
+    for file_hash in set(hashes):
+        derivatives.schedule_tiles(file_hash)
+    logger.info(f"Imported {total} files from {name} for {user.name}")
+    return folder
@@ -0,0 +1,73 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from typing import Dict
+
+from config import SAVE_FILE, config
+from state.game import game_state
+
+logger = logging.getLogger("PlanarAllyServer")
+
+# Upper bound of free pages returned to the filesystem in one run, keeps the write lock short.
+VACUUM_PAGES = config.getint("Maintenance", "vacuum_pages", fallback=2000)
+
+
+def get_stats(conn: sqlite3.Connection) -> Dict[str, int]:
+    return {
+        "file_size": os.path.getsize(SAVE_FILE),
+        "page_size": conn.execute("PRAGMA page_size").fetchone()[0],
+        "page_count": conn.execute("PRAGMA page_count").fetchone()[0],
+        "free_pages": conn.execute("PRAGMA freelist_count").fetchone()[0],
+    }
+
+
+def run_maintenance(idle: bool):
+    """
+    PRAGMA optimize is cheap and always runs.
+    Incremental vacuum and WAL checkpoints only run when no game sessions are active.
+    """
+    start = time.perf_counter()
+    conn = sqlite3.connect(SAVE_FILE, isolation_level=None)
+    try:
+        before = get_stats(conn)
+        conn.execute("PRAGMA optimize")
+        if idle:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                conn.execute(f"PRAGMA incremental_vacuum({VACUUM_PAGES})").fetchall()
+            if conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal":
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+        after = get_stats(conn)
+    finally:
+        conn.close()
+    logger.info(
+        f"Database maintenance ({'full' if idle else 'optimize only'}) done in {time.perf_counter() - start:.2f}s: "
+        f"size {before['file_size']} -> {after['file_size']} bytes, "
+        f"free pages {before['free_pages']} -> {after['free_pages']} of {after['page_count']} ({after['page_size']} bytes/page)"
+    )
+
+
+async def _maintenance_loop(interval: int):
+    while True:
+        await asyncio.sleep(interval * 60)
+        idle = next(game_state.get_sids(), None) is None
+        try:
+            await asyncio.get_event_loop().run_in_executor(
+                None, run_maintenance, idle
+            )
+        except Exception as e:
+            logger.exception(e)
+            logger.error("Database maintenance failed")
+
+
+async def start_maintenance(app):
+    interval = config.getint("Maintenance", "interval", fallback=30)
+    if interval > 0:
+        app["maintenance_task"] = asyncio.ensure_future(_maintenance_loop(interval))
+
+
+async def stop_maintenance(app):
+    task = app.get("maintenance_task", None)
+    if task is not None:
+        task.cancel()
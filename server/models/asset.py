@@ -1,10 +1,117 @@
-from peewee import ForeignKeyField, TextField
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from peewee import (
+    EXCLUDED,
+    Case,
+    FloatField,
+    ForeignKeyField,
+    IntegerField,
+    TextField,
+    Value,
+    fn,
+)
 from playhouse.shortcuts import model_to_dict
 
+from utils import get_asset_path
+
 from .base import BaseModel
+from .db import db
 from .user import User
 
-__all__ = ["Asset"]
+__all__ = ["Asset", "AssetFile"]
+
+# user id -> asset tree as sent to the client
+_structure_cache: Dict[int, Dict[str, Any]] = {}
+# data_version of the connection when the cache was last validated
+_structure_cache_version: Optional[int] = None
+
+
+def get_file_size(file_hash: str) -> int:
+    try:
+        return get_asset_path(file_hash).stat().st_size
+    except FileNotFoundError:
+        return 0
+
+
+class AssetFile(BaseModel):
+    """
+    Reference count of a file in the asset store.
+    Files without references are removed by the asset garbage collector.
+    """
+
+    file_hash = TextField(primary_key=True)
+    references = IntegerField(default=0)
+    # time.time() at which the last reference was released
+    released_at = FloatField(null=True)
+    # Size in bytes, counts towards the asset quota of every user referring to the file
+    size = IntegerField(default=0)
+
+    @classmethod
+    def acquire(cls, file_hash: str, count=1):
+        cls.acquire_many([(file_hash, count)])
+
+    @classmethod
+    def acquire_many(cls, files: Iterable[Tuple[str, int]]):
+        rows = [
+            {"file_hash": file_hash, "references": count, "size": get_file_size(file_hash)}
+            for file_hash, count in files
+        ]
+        if not rows:
+            return
+        cls.insert_many(rows).on_conflict(
+            conflict_target=[cls.file_hash],
+            update={
+                cls.references: cls.references + EXCLUDED.references,
+                cls.released_at: None,
+                cls.size: EXCLUDED.size,
+            },
+        ).execute()
+
+    @classmethod
+    def track_unused(cls, file_hashes: Iterable[str]):
+        """
+        Track stored files that nothing refers to, so the garbage collector removes them.
+        Files that are already tracked are left as they are.
+        """
+        now = time.time()
+        rows = [
+            {
+                "file_hash": file_hash,
+                "references": 0,
+                "released_at": now,
+                "size": get_file_size(file_hash),
+            }
+            for file_hash in set(file_hashes)
+        ]
+        for i in range(0, len(rows), 500):
+            cls.insert_many(rows[i : i + 500]).on_conflict_ignore().execute()
+
+    @classmethod
+    def total_size(cls, files: Iterable[Tuple[str, int]]) -> int:
+        """
+        Combined size of files, counting every file as often as it is given.
+        """
+        files = list(files)
+        total = 0
+        for i in range(0, len(files), 500):
+            counts = dict(files[i : i + 500])
+            for file_hash, size in (
+                cls.select(cls.file_hash, cls.size)
+                .where(cls.file_hash.in_(list(counts)))
+                .tuples()
+            ):
+                total += size * counts[file_hash]
+        return total
+
+    @classmethod
+    def release(cls, files: Iterable[Tuple[str, int]]):
+        now = time.time()
+        for file_hash, count in files:
+            cls.update(
+                references=cls.references - count,
+                released_at=Case(None, [((cls.references - count) <= 0, now)], None),
+            ).where(cls.file_hash == file_hash).execute()
 
 
 class Asset(BaseModel):
@@ -12,17 +119,79 @@ class Asset(BaseModel):
     parent = ForeignKeyField("self", backref="children", null=True, on_delete="CASCADE")
     name = TextField()
     file_hash = TextField(null=True)
+    # Materialized path of names from the root folder, e.g. /maps/dungeons
+    path = TextField(default="")
 
     def __repr__(self):
         return f"<Asset {self.owner.name} - {self.name}>"
 
+    def save(self, *args, **kwargs):
+        """
+        Keeps the materialized path of this asset and all its descendants up to date.
+        """
+        is_new = self.id is None
+        old_path = self.path
+        if self.parent is None:
+            self.path = "/"
+        else:
+            self.path = f"{self.parent.path.rstrip('/')}/{self.name}"
+        with db.atomic():
+            result = super().save(*args, **kwargs)
+            if is_new and self.file_hash:
+                AssetFile.acquire(self.file_hash)
+                User.add_asset_bytes(
+                    self.owner_id, AssetFile.total_size([(self.file_hash, 1)])
+                )
+            if old_path and old_path != self.path and not self.file_hash:
+                Asset.update(
+                    path=Value(self.path).concat(
+                        fn.substr(Asset.path, len(old_path) + 1)
+                    )
+                ).where(self._descendants(old_path)).execute()
+        return result
+
+    def delete_instance(self, *args, **kwargs):
+        """
+        Releases the files of this asset and, for folders, of everything inside it.
+        """
+        with db.atomic():
+            condition = Asset.id == self.id
+            if not self.file_hash:
+                condition |= self._descendants(self.path)
+            files = Asset.count_files(condition)
+            result = super().delete_instance(*args, **kwargs)
+            AssetFile.release(files)
+            User.add_asset_bytes(self.owner_id, -AssetFile.total_size(files))
+        return result
+
+    def _descendants(self, path: str):
+        # Descendant paths sort between "<path>/" and "<path>0" ("0" follows "/")
+        prefix = path.rstrip("/")
+        return (
+            (Asset.owner == self.owner_id)
+            & (Asset.path >= f"{prefix}/")
+            & (Asset.path < f"{prefix}0")
+        )
+
+    @classmethod
+    def count_files(cls, condition) -> List[Tuple[str, int]]:
+        """
+        Amount of assets matching condition per file hash.
+        """
+        return list(
+            cls.select(cls.file_hash, fn.COUNT(cls.id))
+            .where(condition & cls.file_hash.is_null(False))
+            .group_by(cls.file_hash)
+            .tuples()
+        )
+
     def as_dict(self, children=False):
-        asset = model_to_dict(self, exclude=[Asset.owner, Asset.parent])
+        asset = model_to_dict(self, exclude=[Asset.owner, Asset.parent, Asset.path])
         if children:
             asset["children"] = [
                 child.as_dict()
                 for child in Asset.select().where(
-                    (Asset.owner == self.owner) & (Asset.parent == self)
+                    (Asset.owner == self.owner_id) & (Asset.parent == self)
                 )
             ]
         return asset
@@ -32,6 +201,27 @@ class Asset(BaseModel):
             (Asset.owner == self.owner) & (Asset.parent == self) & (Asset.name == name)
         )
 
+    @classmethod
+    def get_folder_path(cls, user, path: str) -> Optional[List["Asset"]]:
+        """
+        Resolve a path like /maps/dungeons to the list of folders along it,
+        or None if any part of the path does not exist.
+        """
+        parts = [part for part in path.split("/") if part]
+        paths = ["/" + "/".join(parts[: i + 1]) for i in range(len(parts))]
+        if not paths:
+            return []
+        folders: Dict[str, "Asset"] = {}
+        for folder in (
+            cls.select()
+            .where((cls.owner == user) & cls.path.in_(paths) & cls.file_hash.is_null())
+            .order_by(cls.id.desc())
+        ):
+            folders[folder.path] = folder
+        if len(folders) != len(paths):
+            return None
+        return [folders[p] for p in paths]
+
     @classmethod
     def get_root_folder(cls, user):
         try:
@@ -41,16 +231,48 @@ class Asset(BaseModel):
         return root
 
     @classmethod
-    def get_user_structure(cls, user, parent=None):
-        if parent is None:
-            parent = cls.get_root_folder(user)
-        # ideally we change this to a single query to get all assets and process them as such
-        data = {"__files": []}
-        for asset in Asset.select().where(
-            (Asset.owner == user) & (Asset.parent == parent)
-        ):
-            if asset.file_hash:
-                data["__files"].append({"name": asset.name, "hash": asset.file_hash})
+    def get_user_structure(cls, user) -> Dict[str, Any]:
+        """
+        The asset tree of a user, cached until `invalidate_user_structure` is called.
+        The returned value is shared and should not be modified.
+        """
+        global _structure_cache_version
+        # data_version changes when another connection, e.g. the asset server process, commits
+        version = db.execute_sql("PRAGMA data_version").fetchone()[0]
+        if version != _structure_cache_version:
+            _structure_cache.clear()
+            _structure_cache_version = version
+        structure = _structure_cache.get(user.id)
+        if structure is None:
+            structure = _structure_cache[user.id] = cls._build_user_structure(user)
+        return structure
+
+    @classmethod
+    def invalidate_user_structure(cls, user):
+        _structure_cache.pop(user.id, None)
+
+    @classmethod
+    def _build_user_structure(cls, user) -> Dict[str, Any]:
+        root = cls.get_root_folder(user)
+        assets = list(
+            cls.select(cls.id, cls.parent, cls.name, cls.file_hash)
+            .where(cls.owner == user)
+            .order_by(cls.id)
+            .tuples()
+        )
+        folders: Dict[int, Dict[str, Any]] = {
+            asset_id: {"__files": []}
+            for asset_id, _, _, file_hash in assets
+            if not file_hash
+        }
+        for asset_id, parent, name, file_hash in assets:
+            if asset_id == root.id or parent not in folders:
+                continue
+            if file_hash:
+                folders[parent]["__files"].append({"name": name, "hash": file_hash})
             else:
-                data[asset.name] = cls.get_user_structure(user, asset)
-        return data
+                folders[parent][name] = folders[asset_id]
+        return folders[root.id]
+
+    class Meta:
+        indexes = ((("owner", "path"), False),)
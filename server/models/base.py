@@ -1,3 +1,5 @@
+from typing import Tuple
+
 from playhouse.signals import Model
 
 from .db import db
@@ -5,7 +7,20 @@ from .db import db
 
 class BaseModel(Model):
     abstract = False
+    # Names of fields that are only changed with atomic updates in SQL.
+    # Saving an existing row leaves them alone, a loaded instance can be outdated.
+    counter_fields: Tuple[str, ...] = ()
 
     class Meta:
         database = db
         legacy_table_names = False
+
+    def save(self, force_insert=False, only=None):
+        updating = not force_insert and self._pk is not None
+        if self.counter_fields and only is None and updating:
+            only = [
+                field
+                for field in self._meta.sorted_fields
+                if field.name not in self.counter_fields
+            ]
+        return super().save(force_insert=force_insert, only=only)
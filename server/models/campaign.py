@@ -1,6 +1,9 @@
 import uuid
+from typing import Any, Callable, Dict, List, Optional
+
 from peewee import (
     fn,
+    JOIN,
     BooleanField,
     FloatField,
     ForeignKeyField,
@@ -24,6 +27,9 @@ __all__ = [
     "Room",
 ]
 
+# room id -> data sent to every client that joins the room, see Room.get_info
+_bootstrap_cache: Dict[int, Dict[str, Any]] = {}
+
 
 class LocationOptions(BaseModel):
     unit_size = FloatField(default=5, null=True)
@@ -47,6 +53,12 @@ class LocationOptions(BaseModel):
             if v is not None
         }
 
+    def save(self, *args, **kwargs):
+        result = super().save(*args, **kwargs)
+        # Both room defaults and location options are cached, which room they belong to is not known here
+        Room.forget_bootstrap()
+        return result
+
 
 class Room(BaseModel):
     name = TextField()
@@ -54,6 +66,10 @@ class Room(BaseModel):
     invitation_code = TextField(default=uuid.uuid4, unique=True)
     is_locked = BooleanField(default=False)
     default_options = ForeignKeyField(LocationOptions, on_delete="CASCADE")
+    # Amount of shapes in all locations, kept up to date by the shape handlers
+    shape_count = IntegerField(default=0)
+
+    counter_fields = ("shape_count",)
 
     def __repr__(self):
         return f"<Room {self.get_path()}>"
@@ -61,6 +77,94 @@ class Room(BaseModel):
     def get_path(self):
         return f"{self.creator.name}/{self.name}"
 
+    def save(self, *args, **kwargs):
+        result = super().save(*args, **kwargs)
+        Room.forget_bootstrap(self.id)
+        return result
+
+    def delete_instance(self, *args, **kwargs):
+        result = super().delete_instance(*args, **kwargs)
+        Room.forget_bootstrap(self.id)
+        return result
+
+    @classmethod
+    def forget_bootstrap(cls, room_id: Optional[int] = None):
+        """
+        Drop the cached data of a room, or of all rooms if no room is given.
+        """
+        if room_id is None:
+            _bootstrap_cache.clear()
+        else:
+            _bootstrap_cache.pop(room_id, None)
+
+    def _get_cached(self, key: str, build: Callable[[], Any]) -> Any:
+        cache = _bootstrap_cache.setdefault(self.id, {})
+        if key not in cache:
+            cache[key] = build()
+        return cache[key]
+
+    def get_info(self) -> Dict[str, Any]:
+        """
+        The room info sent to joining clients, cached until the room or its players change.
+        The returned value is shared and should not be modified.
+        """
+        return self._get_cached("info", self._build_info)
+
+    def _build_info(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "creator": self.creator.name,
+            "invitationCode": str(self.invitation_code),
+            "isLocked": self.is_locked,
+            "default_options": self.default_options.as_dict(),
+            "players": [
+                {"id": player_id, "name": name, "location": location_id}
+                for player_id, name, location_id in PlayerRoom.select(
+                    User.id, User.name, PlayerRoom.active_location
+                )
+                .join(User)
+                .where(PlayerRoom.room == self)
+                .tuples()
+            ],
+        }
+
+    def get_location_settings(self) -> Dict[str, Any]:
+        """
+        The options of every location by name, cached until a location or its options change.
+        The returned value is shared and should not be modified.
+        """
+        return self._get_cached(
+            "locations",
+            lambda: {
+                l.name: {} if l.options is None else l.options.as_dict()
+                for l in Location.select(Location, LocationOptions)
+                .join(LocationOptions, JOIN.LEFT_OUTER)
+                .where(Location.room == self)
+            },
+        )
+
+    @classmethod
+    def add_shapes(cls, room_id: int, delta: int):
+        cls.update(shape_count=cls.shape_count + delta).where(
+            cls.id == room_id
+        ).execute()
+
+    def update_shape_count(self):
+        """
+        Recount the shapes of this room, for bulk removals such as removing a floor or location.
+        """
+        from .shape import Shape
+
+        count = (
+            Shape.select()
+            .join(Layer)
+            .join(Floor)
+            .join(Location)
+            .where(Location.room == self)
+            .count()
+        )
+        Room.update(shape_count=count).where(Room.id == self.id).execute()
+
     class Meta:
         indexes = ((("name", "creator"), True),)
 
@@ -77,6 +181,16 @@ class Location(BaseModel):
     def get_path(self):
         return f"{self.room.get_path()}/{self.name}"
 
+    def save(self, *args, **kwargs):
+        result = super().save(*args, **kwargs)
+        Room.forget_bootstrap(self.room_id)
+        return result
+
+    def delete_instance(self, *args, **kwargs):
+        result = super().delete_instance(*args, **kwargs)
+        Room.forget_bootstrap(self.room_id)
+        return result
+
     def as_dict(self):
         data = model_to_dict(
             self,
@@ -162,6 +276,16 @@ class PlayerRoom(BaseModel):
     def __repr__(self):
         return f"<PlayerRoom {self.room.get_path()} - {self.player.name}>"
 
+    def save(self, *args, **kwargs):
+        result = super().save(*args, **kwargs)
+        Room.forget_bootstrap(self.room_id)
+        return result
+
+    def delete_instance(self, *args, **kwargs):
+        result = super().delete_instance(*args, **kwargs)
+        Room.forget_bootstrap(self.room_id)
+        return result
+
 
 class Note(BaseModel):
     uuid = TextField(primary_key=True)
@@ -191,16 +315,15 @@ class Floor(BaseModel):
         return f"<Floor {self.name} {[self.index]}>"
 
     def as_dict(self, user: User, dm: bool):
+        from .shape import Shape
+
         data = model_to_dict(self, recurse=False, exclude=[Floor.id, Floor.location])
-        if dm:
-            data["layers"] = [
-                l.as_dict(user, True) for l in self.layers.order_by(Layer.index)
-            ]
-        else:
-            data["layers"] = [
-                l.as_dict(user, False)
-                for l in self.layers.order_by(Layer.index).where(Layer.player_visible)
-            ]
+        layers = self.layers.order_by(Layer.index)
+        if not dm:
+            layers = layers.where(Layer.player_visible)
+        layers = list(layers)
+        shapes = Shape.as_dicts(self, layers, user, dm)
+        data["layers"] = [l.as_dict(user, dm, shapes[l.id]) for l in layers]
         return data
 
 
@@ -220,7 +343,12 @@ class Layer(BaseModel):
     def get_path(self):
         return f"{self.floor.location.get_path()}/{self.name}"
 
-    def as_dict(self, user: User, dm: bool):
+    def as_dict(
+        self, user: User, dm: bool, shapes: Optional[List[Dict[str, Any]]] = None
+    ):
+        """
+        Serialize the layer with its shapes, pass `shapes` if they were serialized already.
+        """
         from .shape import Shape
 
         data = model_to_dict(
@@ -229,9 +357,9 @@ class Layer(BaseModel):
             backrefs=False,
             exclude=[Layer.id, Layer.player_visible],
         )
-        data["shapes"] = [
-            shape.as_dict(user, dm) for shape in self.shapes.order_by(Shape.index)
-        ]
+        if shapes is None:
+            shapes = Shape.as_dicts(self.floor, [self], user, dm)[self.id]
+        data["shapes"] = shapes
         return data
 
     class Meta:
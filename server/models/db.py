@@ -8,6 +8,8 @@ db = SqliteExtDatabase(
         # "journal_mode": "wal",
         # "cache_size": -1 * 6400,
         "foreign_keys": 1,
+        # Only has effect on new save files, existing saves are converted in save.py
+        "auto_vacuum": "incremental",
         # "ignore_check_constraints": 0,
         # "synchronous": 0,
     },
@@ -1,3 +1,5 @@
+from typing import Any, Dict, List, Optional
+
 from peewee import BooleanField, ForeignKeyField, TextField
 from playhouse.shortcuts import model_to_dict
 
@@ -8,6 +10,10 @@ from .user import User
 
 __all__ = ["Label", "LabelSelection"]
 
+# Labels visible to everyone and the hidden labels per user id, see Label.get_for_user
+_visible_cache: Optional[List[Dict[str, Any]]] = None
+_hidden_cache: Dict[int, List[Dict[str, Any]]] = {}
+
 
 class Label(BaseModel):
     uuid = TextField(primary_key=True)
@@ -21,6 +27,43 @@ class Label(BaseModel):
         d["user"] = self.user.name
         return d
 
+    def save(self, *args, **kwargs):
+        result = super().save(*args, **kwargs)
+        Label.forget_cache()
+        return result
+
+    def delete_instance(self, *args, **kwargs):
+        result = super().delete_instance(*args, **kwargs)
+        Label.forget_cache()
+        return result
+
+    @classmethod
+    def forget_cache(cls):
+        global _visible_cache
+        _visible_cache = None
+        _hidden_cache.clear()
+
+    @classmethod
+    def get_for_user(cls, user: User) -> List[Dict[str, Any]]:
+        """
+        The labels of user and the visible labels of everyone else, cached until a label changes.
+        """
+        global _visible_cache
+        if _visible_cache is None:
+            _visible_cache = [
+                l.as_dict()
+                for l in cls.select(cls, User).join(User).where(cls.visible == True)
+            ]
+        hidden = _hidden_cache.get(user.id, None)
+        if hidden is None:
+            hidden = _hidden_cache[user.id] = [
+                l.as_dict()
+                for l in cls.select(cls, User)
+                .join(User)
+                .where((cls.user == user) & (cls.visible == False))
+            ]
+        return _visible_cache + hidden
+
 
 class LabelSelection(BaseModel):
     label = ForeignKeyField(Label, on_delete="CASCADE")
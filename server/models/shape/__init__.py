@@ -1,5 +1,15 @@
-import json
-from peewee import BooleanField, FloatField, ForeignKeyField, IntegerField, TextField
+import struct
+from collections import defaultdict
+from typing import Any, Dict, List
+
+from peewee import (
+    BlobField,
+    BooleanField,
+    FloatField,
+    ForeignKeyField,
+    IntegerField,
+    TextField,
+)
 from playhouse.shortcuts import model_to_dict, update_model_from_dict
 
 from ..base import BaseModel
@@ -91,6 +101,87 @@ class Shape(BaseModel):
     def subtype(self):
         return getattr(self, f"{self.type_}_set").get()
 
+    @classmethod
+    def as_dicts(
+        cls, floor, layers: List[Layer], user: User, dm: bool
+    ) -> Dict[int, List[Dict[str, Any]]]:
+        """
+        Serialize the shapes of layers of floor the same way as as_dict.
+        Every related table is read with one query instead of several queries per shape.
+        Returns the shapes of every layer id in order.
+        """
+        layer_names = {layer.id: layer.name for layer in layers}
+        # Plain rows instead of model instances, as_dict only uses the fields
+        shapes = list(
+            cls.select()
+            .where(cls.layer.in_(list(layer_names)))
+            .order_by(cls.index)
+            .dicts()
+        )
+        uuids = cls.select(cls.uuid).where(cls.layer.in_(list(layer_names)))
+
+        owners: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        for owner in (
+            ShapeOwner.select(ShapeOwner, User)
+            .join(User)
+            .where(ShapeOwner.shape.in_(uuids))
+        ):
+            owners[owner.shape_id].append(owner.as_dict())
+        trackers: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        for tracker in Tracker.select().where(Tracker.shape.in_(uuids)).dicts():
+            trackers[tracker.pop("shape")].append(tracker)
+        auras: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        for aura in Aura.select().where(Aura.shape.in_(uuids)).dicts():
+            auras[aura.pop("shape")].append(aura)
+        labels: Dict[str, List[Label]] = defaultdict(list)
+        for shape_label in (
+            ShapeLabel.select(ShapeLabel, Label, User)
+            .join(Label)
+            .join(User)
+            .where(ShapeLabel.shape.in_(uuids))
+        ):
+            labels[shape_label.shape_id].append(shape_label.label)
+        subtypes: Dict[str, Dict[str, Any]] = {}
+        for type_ in {shape["type_"] for shape in shapes}:
+            model = get_table(type_)
+            query = model.select().where(model.shape.in_(uuids))
+            if model.as_dict is ShapeType.as_dict:
+                for subtype in query.dicts():
+                    subtypes[subtype.pop("shape")] = subtype
+            else:
+                for subtype in query:
+                    subtypes[subtype.shape_id] = subtype.as_dict(exclude=[model.shape])
+
+        result: Dict[int, List[Dict[str, Any]]] = {
+            layer_id: [] for layer_id in layer_names
+        }
+        for data in shapes:
+            layer_id = data.pop("layer")
+            del data["index"]
+            data["owners"] = owners[data["uuid"]]
+            data["layer"] = layer_names[layer_id]
+            data["floor"] = floor.name
+            owned = (
+                dm
+                or data["default_edit_access"]
+                or data["default_vision_access"]
+                or any(user.name == o["user"] for o in data["owners"])
+            )
+            if not owned:
+                data["annotation"] = ""
+            if not data["name_visible"]:
+                data["name"] = "?"
+            data["trackers"] = [
+                t for t in trackers[data["uuid"]] if owned or t["visible"]
+            ]
+            data["auras"] = [a for a in auras[data["uuid"]] if owned or a["visible"]]
+            data["labels"] = [
+                l.as_dict() for l in labels[data["uuid"]] if owned or l.visible
+            ]
+            data.update(**subtypes[data["uuid"]])
+            result[layer_id].append(data)
+        return result
+
 
 class ShapeLabel(BaseModel):
     shape = ForeignKeyField(Shape, backref="labels", on_delete="CASCADE")
@@ -143,7 +234,7 @@ class ShapeOwner(BaseModel):
 
     def as_dict(self):
         return {
-            "shape": self.shape.uuid,
+            "shape": self.shape_id,
             "user": self.user.name,
             "edit_access": self.edit_access,
             "vision_access": self.vision_access,
@@ -190,19 +281,41 @@ class Line(ShapeType):
     line_width = IntegerField()
 
 
+def pack_points(points: List[Dict[str, float]]) -> bytes:
+    return struct.pack(
+        f"<{2 * len(points)}d", *(c for p in points for c in (p["x"], p["y"]))
+    )
+
+
+def unpack_points(data: bytes) -> List[Dict[str, float]]:
+    return [{"x": x, "y": y} for x, y in struct.iter_unpack("<dd", data)]
+
+
+class PointsField(BlobField):
+    """
+    Stores a list of {x, y} points as packed little-endian float64 pairs.
+    The raw buffer is kept on the model, decoding only happens in as_dict.
+    """
+
+    def db_value(self, value):
+        if isinstance(value, (list, tuple)):
+            value = pack_points(value)
+        return super().db_value(value)
+
+
 class Polygon(ShapeType):
     abstract = False
-    vertices = TextField()
+    vertices = PointsField()
     line_width = IntegerField()
     open_polygon = BooleanField()
 
     def as_dict(self, *args, **kwargs):
         model = model_to_dict(self, *args, **kwargs)
-        model["vertices"] = json.loads(model["vertices"])
+        model["vertices"] = unpack_points(model["vertices"])
         return model
 
     def update_from_dict(self, data, *args, **kwargs):
-        data["vertices"] = json.dumps(data["vertices"])
+        data["vertices"] = pack_points(data["vertices"])
         return update_model_from_dict(self, data, *args, **kwargs)
 
 
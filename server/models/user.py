@@ -1,5 +1,8 @@
+import time
+from typing import Dict, Optional, Tuple
+
 import bcrypt
-from peewee import fn, BooleanField, ForeignKeyField, TextField
+from peewee import BooleanField, ForeignKeyField, IntegerField, TextField
 from playhouse.shortcuts import model_to_dict
 
 from .base import BaseModel
@@ -7,23 +10,66 @@ from .base import BaseModel
 
 __all__ = ["User"]
 
+# Seconds a session identity stays resolved to a user, see User.by_identity
+IDENTITY_TTL = 10
+# lowercase identity -> (expiry, user)
+_identity_cache: Dict[str, Tuple[float, "User"]] = {}
+
 
 class User(BaseModel):
     name = TextField()
+    # Lowercase name, usernames are unique regardless of case
+    normalized_name = TextField(null=True, unique=True)
     email = TextField(null=True)
     password_hash = TextField()
     fow_colour = TextField(default="#000")
     grid_colour = TextField(default="#000")
     ruler_colour = TextField(default="#F00")
     invert_alt = BooleanField(default=False)
+    # Combined size of the files of all assets of this user, maintained by Asset
+    asset_bytes = IntegerField(default=0)
+
+    counter_fields = ("asset_bytes",)
 
     def __repr__(self):
         return f"<User {self.name}>"
 
-    def set_password(self, pw):
-        pwhash = bcrypt.hashpw(pw.encode("utf8"), bcrypt.gensalt())
+    def save(self, *args, **kwargs):
+        self.normalized_name = self.name.lower()
+        result = super().save(*args, **kwargs)
+        self._forget_identity()
+        return result
+
+    def delete_instance(self, *args, **kwargs):
+        from .campaign import Room
+        from .label import Label
+
+        result = super().delete_instance(*args, **kwargs)
+        self._forget_identity()
+        # Their rooms, memberships and labels are removed by the database
+        Room.forget_bootstrap()
+        Label.forget_cache()
+        return result
+
+    def _forget_identity(self):
+        for key, (_, user) in list(_identity_cache.items()):
+            if user.id == self.id:
+                del _identity_cache[key]
+
+    def set_password(self, pw, rounds=12):
+        pwhash = bcrypt.hashpw(pw.encode("utf8"), bcrypt.gensalt(rounds))
         self.password_hash = pwhash.decode("utf8")
 
+    def needs_rehash(self, rounds: int) -> bool:
+        """
+        Whether the password hash was made with a different bcrypt cost factor.
+        """
+        try:
+            # $2b$<cost>$<salt and hash>
+            return int(self.password_hash.split("$")[2]) != rounds
+        except (AttributeError, IndexError, ValueError):
+            return False
+
     def check_password(self, pw):
         if self.password_hash is None:
             return False
@@ -31,8 +77,46 @@ class User(BaseModel):
         return bcrypt.checkpw(pw.encode("utf8"), expected_hash)
 
     def as_dict(self):
-        return model_to_dict(self, recurse=False, exclude=[User.id, User.password_hash])
+        return model_to_dict(
+            self,
+            recurse=False,
+            exclude=[
+                User.id,
+                User.normalized_name,
+                User.password_hash,
+                User.asset_bytes,
+            ],
+        )
+
+    @classmethod
+    def add_asset_bytes(cls, user_id: int, delta: int):
+        if delta:
+            cls.update(asset_bytes=cls.asset_bytes + delta).where(
+                cls.id == user_id
+            ).execute()
 
     @classmethod
     def by_name(cls, name):
-        return cls.get_or_none(fn.Lower(cls.name) == name.lower())
+        return cls.get_or_none(cls.normalized_name == name.lower())
+
+    @classmethod
+    def by_identity(cls, identity: str) -> Optional["User"]:
+        """
+        by_name for the identity of a session, which is resolved on every authenticated request.
+        Users are cached for IDENTITY_TTL seconds, saving or deleting a user drops it from the cache.
+        """
+        key = identity.lower()
+        now = time.monotonic()
+        cached = _identity_cache.get(key, None)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        user = cls.by_name(identity)
+        if user is None:
+            _identity_cache.pop(key, None)
+        else:
+            if len(_identity_cache) > 1000:
+                for k, (expiry, _) in list(_identity_cache.items()):
+                    if expiry <= now:
+                        del _identity_cache[k]
+            _identity_cache[key] = (now + IDENTITY_TTL, user)
+        return user
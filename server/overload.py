@@ -0,0 +1,125 @@
+"""
+Load shedding while the event loop is overloaded.
+
+The lag of the event loop and the amount of socket events being handled are measured continuously.
+Once either exceeds its threshold, socket events of low value are dropped or reduced before they
+reach their handler, so persistent changes keep getting handled in time.
+Handlers opt in with the `shed` argument of auth.login_required.
+"""
+import asyncio
+import logging
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, Optional
+
+from config import config
+
+logger = logging.getLogger("PlanarAllyServer")
+
+# Seconds between two lag measurements
+INTERVAL = 0.1
+MAX_LAG = config.getint("Overload", "max_lag_ms", fallback=100) / 1000
+MAX_PENDING = config.getint("Overload", "max_pending", fallback=200)
+
+Shed = Callable[[Any], Optional[Any]]
+
+
+class OverloadState:
+    def __init__(self) -> None:
+        self.shedding = False
+        self.since = time.time()
+        # Exponentially weighted moving average of the loop lag in seconds
+        self.lag = 0.0
+        self.max_lag = 0.0
+        # Socket events that are being handled
+        self.pending = 0
+        self.shed: Counter = Counter()
+
+    def update(self, lag: float) -> None:
+        self.lag = 0.7 * self.lag + 0.3 * lag
+        self.max_lag = max(self.max_lag, lag)
+        if not self.shedding and (self.lag > MAX_LAG or self.pending > MAX_PENDING):
+            self.shedding = True
+            self.since = time.time()
+            logger.warning(
+                f"Server is overloaded (loop lag {self.lag * 1000:.0f}ms, {self.pending} pending events), shedding low value events"
+            )
+        elif (
+            self.shedding
+            and self.lag < MAX_LAG / 2
+            and self.pending < MAX_PENDING / 2
+        ):
+            logger.info(
+                f"Server load is back to normal after {time.time() - self.since:.1f}s, shed {sum(self.shed.values())} events in total"
+            )
+            self.shedding = False
+            self.since = time.time()
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "shedding": self.shedding,
+            "since": self.since,
+            "lag_ms": round(self.lag * 1000, 1),
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "pending": self.pending,
+            "thresholds": {"lag_ms": MAX_LAG * 1000, "pending": MAX_PENDING},
+            "shed": dict(self.shed),
+        }
+
+
+state = OverloadState()
+
+
+def filter_event(handler: str, shed: Optional[Shed], data: Any) -> Any:
+    """
+    Returns the data to handle the event with or None if it should be dropped.
+    """
+    if shed is None or not state.shedding:
+        return data
+    reduced = shed(data)
+    if reduced is not data:
+        state.shed[handler] += 1
+    return reduced
+
+
+def drop(data: Any) -> None:
+    return None
+
+
+def drop_temporary(data: Any) -> Optional[Any]:
+    """
+    Drop temporary shape updates, the final update of a drag or draw is persistent and still handled.
+    """
+    if isinstance(data, dict) and data.get("temporary", False):
+        return None
+    return data
+
+
+def without(*keys: str) -> Shed:
+    """
+    Remove keys from the event data, the event is dropped if nothing is left.
+    """
+
+    def shed(data: Any) -> Optional[Any]:
+        if not isinstance(data, dict) or not any(key in data for key in keys):
+            return data
+        reduced = {k: v for k, v in data.items() if k not in keys}
+        return reduced or None
+
+    return shed
+
+
+async def _monitor_loop():
+    loop = asyncio.get_event_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(INTERVAL)
+        state.update(max(0.0, loop.time() - start - INTERVAL))
+
+
+async def start_monitor(app):
+    app["overload_task"] = asyncio.ensure_future(_monitor_loop())
+
+
+async def stop_monitor(app):
+    app["overload_task"].cancel()
@@ -0,0 +1,103 @@
+"""
+Password hashing and verification in a bounded thread pool.
+
+bcrypt is slow on purpose, running it on the event loop would stall every game session
+for the duration of a login. Calls beyond the pool size wait in a queue of limited length,
+once that is full new calls are rejected instead of piling up.
+"""
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Tuple, TypeVar
+
+from config import config
+from models import User
+
+logger = logging.getLogger("PlanarAllyServer")
+
+T = TypeVar("T")
+
+# bcrypt cost factor, existing passwords are rehashed on login when this changes
+BCRYPT_ROUNDS = config.getint("Passwords", "bcrypt_rounds", fallback=12)
+WORKERS = config.getint("Passwords", "workers", fallback=2)
+# Amount of calls that can wait for a free worker
+MAX_QUEUE = config.getint("Passwords", "max_queue", fallback=32)
+
+_executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="passwords")
+_stats: Dict[str, Any] = {
+    "pending": 0,
+    "peak_pending": 0,
+    "completed": 0,
+    "rejected": 0,
+    "wait_time": 0.0,
+    "max_wait_time": 0.0,
+    "hash_time": 0.0,
+}
+
+
+class PasswordQueueFull(Exception):
+    pass
+
+
+def _timed(fn: Callable[..., T], queued_at: float, *args) -> Tuple[float, float, T]:
+    started = time.perf_counter()
+    result = fn(*args)
+    return started - queued_at, time.perf_counter() - started, result
+
+
+async def _run(fn: Callable[..., T], *args) -> T:
+    if _stats["pending"] >= WORKERS + MAX_QUEUE:
+        _stats["rejected"] += 1
+        logger.warning(f"Rejected password check, {_stats['pending']} are pending")
+        raise PasswordQueueFull("The server is busy, try again later.")
+    _stats["pending"] += 1
+    _stats["peak_pending"] = max(_stats["peak_pending"], _stats["pending"])
+    try:
+        wait_time, hash_time, result = await asyncio.get_event_loop().run_in_executor(
+            _executor, _timed, fn, time.perf_counter(), *args
+        )
+    finally:
+        _stats["pending"] -= 1
+    _stats["completed"] += 1
+    _stats["wait_time"] += wait_time
+    _stats["max_wait_time"] = max(_stats["max_wait_time"], wait_time)
+    _stats["hash_time"] += hash_time
+    return result
+
+
+async def set_password(user: User, password: str) -> None:
+    """
+    Hash password for user, the user still has to be saved.
+    Raises PasswordQueueFull if too many passwords are being hashed.
+    """
+    await _run(user.set_password, password, BCRYPT_ROUNDS)
+
+
+async def check_password(user: User, password: str) -> bool:
+    """
+    Verify the password of user, passwords hashed with another cost factor are rehashed and saved.
+    Raises PasswordQueueFull if too many passwords are being hashed.
+    """
+    if not await _run(user.check_password, password):
+        return False
+    if user.needs_rehash(BCRYPT_ROUNDS):
+        await set_password(user, password)
+        user.save()
+        logger.info(f"Rehashed the password of {user.name} with cost {BCRYPT_ROUNDS}")
+    return True
+
+
+def get_stats() -> Dict[str, Any]:
+    completed = _stats["completed"] or 1
+    return {
+        "workers": WORKERS,
+        "max_queue": MAX_QUEUE,
+        "pending": _stats["pending"],
+        "peak_pending": _stats["peak_pending"],
+        "completed": _stats["completed"],
+        "rejected": _stats["rejected"],
+        "avg_wait_ms": round(_stats["wait_time"] / completed * 1000, 1),
+        "max_wait_ms": round(_stats["max_wait_time"] * 1000, 1),
+        "avg_hash_ms": round(_stats["hash_time"] / completed * 1000, 1),
+    }
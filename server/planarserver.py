@@ -15,18 +15,22 @@ save.check_save()
 
 import asyncio
 import configparser
+import multiprocessing
 import sys
 
 from aiohttp import web
 
 import api.http
+import backup
+import maintenance
+import overload
 import routes
 from state.asset import asset_state
 from state.game import game_state
 
 # Force loading of socketio routes
 from api.socket import *
-from app import app, logger, sio
+from app import ASSET_SERVER_ENABLED, ASSET_SOCKET_PATH, app, logger, sio
 from config import config
 
 # This is a fix for asyncio problems on windows that make it impossible to do ctrl+c
@@ -43,6 +47,12 @@ async def on_shutdown(_):
         await sio.disconnect(sid, namespace="/planarally")
 
 
+if not ASSET_SERVER_ENABLED:
+    sio.attach(app, socketio_path=ASSET_SOCKET_PATH)
+    api.http.assets.add_routes(app)
+app.router.add_get(
+    r"/static/{kind:js|css}/{name:[^/]+\.(?:js|css|map)}", routes.serve_bundle
+)
 app.router.add_static("/static", "static")
 app.router.add_get("/api/auth", api.http.auth.is_authed)
 app.router.add_post("/api/users/email", api.http.users.set_email)
@@ -55,13 +65,26 @@ app.router.add_get("/api/rooms", api.http.rooms.get_list)
 app.router.add_post("/api/rooms", api.http.rooms.create)
 app.router.add_post("/api/invite", api.http.claim_invite)
 app.router.add_get("/api/version", api.http.version.get_version)
+app.router.add_post("/api/admin/snapshot", api.http.admin.create_snapshot)
+app.router.add_get("/api/admin/passwords", api.http.admin.get_password_stats)
+app.router.add_get("/api/admin/ratelimits", api.http.admin.get_rate_limit_stats)
+app.router.add_get("/api/admin/overload", api.http.admin.get_overload_state)
+app.router.add_get("/api/admin/bootstraps", api.http.admin.get_bootstrap_stats)
 
 if "dev" in sys.argv:
     app.router.add_route("*", "/{tail:.*}", routes.root_dev)
 else:
     app.router.add_route("*", "/{tail:.*}", routes.root)
 
+app.on_startup.append(backup.start_snapshots)
+app.on_startup.append(maintenance.start_maintenance)
+app.on_startup.append(overload.start_monitor)
 app.on_shutdown.append(on_shutdown)
+app.on_cleanup.append(backup.stop_snapshots)
+app.on_cleanup.append(maintenance.stop_maintenance)
+app.on_cleanup.append(overload.stop_monitor)
+if not ASSET_SERVER_ENABLED:
+    api.http.assets.add_background_tasks(app)
 
 
 def start_http(host, port):
@@ -91,6 +114,8 @@ def start_socket(sock):
 
 
 if __name__ == "__main__":
+    # Asset derivatives are generated in a process pool
+    multiprocessing.freeze_support()
     socket = config.get("Webserver", "socket", fallback=None)
     if socket:
         start_socket(socket)
@@ -0,0 +1,43 @@
+"""
+Storage quotas of users and rooms.
+
+Quotas are checked against usage counters that are kept up to date on the models
+(User.asset_bytes and Room.shape_count), so enforcing them never scans assets or shapes.
+"""
+from config import config
+from models import Room, User
+
+MB = 1024 * 1024
+
+# 0 disables the quota
+USER_ASSET_BYTES = config.getint("Quotas", "user_assets_mb", fallback=0) * MB
+ROOM_SHAPES = config.getint("Quotas", "room_shapes", fallback=0)
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+def check_asset_quota(user: User, size: int) -> None:
+    """
+    Raises QuotaExceeded if `size` more bytes of assets do not fit in the quota of user.
+    """
+    if not USER_ASSET_BYTES:
+        return
+    used = User.select(User.asset_bytes).where(User.id == user.id).scalar() or 0
+    if used + size > USER_ASSET_BYTES:
+        raise QuotaExceeded(
+            f"This exceeds your storage quota of {USER_ASSET_BYTES // MB}MB, "
+            f"{used / MB:.1f}MB is in use."
+        )
+
+
+def check_shape_quota(room: Room, amount=1) -> None:
+    """
+    Raises QuotaExceeded if `amount` more shapes do not fit in the quota of room.
+    """
+    if not ROOM_SHAPES:
+        return
+    used = Room.select(Room.shape_count).where(Room.id == room.id).scalar() or 0
+    if used + amount > ROOM_SHAPES:
+        raise QuotaExceeded(f"This room has reached its limit of {ROOM_SHAPES} shapes.")
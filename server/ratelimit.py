@@ -0,0 +1,168 @@
+"""
+Rate limiting of inbound socket events.
+
+Every sid gets a token bucket per kind of event. Temporary updates of a shape (e.g. while it is
+being dragged) that exceed the rate are coalesced, only the latest one is handled once a token
+frees up. Waiting events of handlers that set options are merged into one, later values of an
+option replace earlier ones. Other temporary events are dropped when they would have to wait
+longer than MAX_DELAY seconds. All other events change persistent state, they are delayed until
+a token frees up. Only when MAX_BACKLOG events of a sid are already waiting for the same kind
+are they dropped as well, so a misbehaving client can not queue up work without bound.
+"""
+import asyncio
+import logging
+import time
+from collections import Counter
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from config import config
+
+logger = logging.getLogger("PlanarAllyServer")
+
+# kind: (events per second, burst)
+DEFAULT_LIMITS = {
+    "movement": "120, 240",
+    "options": "10, 20",
+    "upload": "200, 400",
+    "default": "20, 40",
+}
+LIMITS: Dict[str, Tuple[float, float]] = {
+    kind: tuple(  # type: ignore
+        float(part)
+        for part in config.get("RateLimits", kind, fallback=fallback).split(",")
+    )
+    for kind, fallback in DEFAULT_LIMITS.items()
+}
+MAX_DELAY = config.getfloat("RateLimits", "max_delay", fallback=5)
+MAX_BACKLOG = config.getint("RateLimits", "max_backlog", fallback=100)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def reserve(self, max_delay: Optional[float] = None) -> Optional[float]:
+        """
+        Take a token and return how long to wait until it is available,
+        or None if that is longer than `max_delay`.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        delay = max(0.0, (1 - self.tokens) / self.rate)
+        if max_delay is not None and delay > max_delay:
+            return None
+        self.tokens -= 1
+        return delay
+
+
+_buckets: Dict[Tuple[Any, str], TokenBucket] = {}
+# (sid, coalescing key) -> arguments of the latest waiting event
+_waiting: Dict[Tuple[Any, Hashable], tuple] = {}
+# (sid, kind) -> amount of events that are waiting for a token
+_backlog: Counter = Counter()
+_stats: Counter = Counter()
+_warned = set()
+
+
+def _is_temporary(args: tuple) -> bool:
+    data = args[1] if len(args) > 1 else None
+    return isinstance(data, dict) and bool(data.get("temporary", False))
+
+
+def _coalesce_key(handler: str, args: tuple, merge: bool) -> Optional[Hashable]:
+    if merge and len(args) > 1 and isinstance(args[1], dict):
+        return (handler,)
+    if _is_temporary(args):
+        data = args[1]
+        try:
+            return (handler, data["shape"]["uuid"])
+        except (KeyError, TypeError):
+            pass
+    return None
+
+
+async def admit(
+    kind: str, handler: str, args: tuple, merge: bool = False
+) -> Optional[tuple]:
+    """
+    Wait until an event for `handler` with arguments `args` may be handled.
+    Returns the arguments to handle it with, or None if it should be skipped.
+    With `merge` the data of a waiting event is updated with the data of later ones.
+    """
+    sid = args[0]
+    bucket = _buckets.get((sid, kind), None)
+    if bucket is None:
+        bucket = _buckets[(sid, kind)] = TokenBucket(*LIMITS[kind])
+
+    key = _coalesce_key(handler, args, merge)
+    if key is not None and (sid, key) in _waiting:
+        # An earlier event is waiting and will be handled with these arguments
+        if merge:
+            waiting = _waiting[(sid, key)]
+            args = (sid, {**waiting[1], **args[1]}, *args[2:])
+        _waiting[(sid, key)] = args
+        _stats[(kind, "coalesced")] += 1
+        return None
+
+    if _backlog[(sid, kind)] >= MAX_BACKLOG:
+        _stats[(kind, "dropped")] += 1
+        if sid not in _warned:
+            _warned.add(sid)
+            logger.warning(
+                f"Dropping {kind} events of {sid}, {MAX_BACKLOG} of them are already waiting"
+            )
+        return None
+
+    # Persistent changes are only ever delayed, dropping them would silently lose state
+    delay = bucket.reserve(MAX_DELAY if _is_temporary(args) else None)
+    if delay is None:
+        _stats[(kind, "dropped")] += 1
+        if sid not in _warned:
+            _warned.add(sid)
+            logger.warning(
+                f"Dropping temporary {kind} events of {sid}, it exceeds the rate limit"
+            )
+        return None
+    if delay == 0:
+        return args
+
+    _stats[(kind, "delayed")] += 1
+    _backlog[(sid, kind)] += 1
+    if key is not None:
+        _waiting[(sid, key)] = args
+    try:
+        await asyncio.sleep(delay)
+    finally:
+        _backlog[(sid, kind)] -= 1
+        if _backlog[(sid, kind)] == 0:
+            del _backlog[(sid, kind)]
+        if key is not None:
+            args = _waiting.pop((sid, key))
+    return args
+
+
+def forget(sid) -> None:
+    for key in [key for key in _buckets if key[0] == sid]:
+        del _buckets[key]
+    _warned.discard(sid)
+
+
+def get_stats() -> Dict[str, Any]:
+    return {
+        "clients": len({sid for sid, _ in _buckets}),
+        "limits": {
+            kind: {
+                "rate": rate,
+                "burst": burst,
+                "delayed": _stats[(kind, "delayed")],
+                "coalesced": _stats[(kind, "coalesced")],
+                "dropped": _stats[(kind, "dropped")],
+                "waiting": sum(n for (_, k), n in _backlog.items() if k == kind),
+            }
+            for kind, (rate, burst) in LIMITS.items()
+        },
+    }
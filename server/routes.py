@@ -1,7 +1,16 @@
+import asyncio
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import time
+from typing import Dict, Optional, Tuple
+
 import aiohttp
 import aiohttp_jinja2
 
-from aiohttp import web
+from aiohttp import hdrs, web
 from aiohttp_security import authorized_userid, check_authorized, forget, remember
 
 from app import app, logger
@@ -10,10 +19,145 @@ from models.db import db
 from models.role import Role
 
 
-# @aiohttp_jinja2.template("app.jinja2")
+# Bundle files built for production carry a content hash in their name, e.g. app.1c2f3a4b.js
+HASHED_NAME_RE = re.compile(r".+\.[0-9a-f]{8,}\.(js|css)(\.map)?$")
+# Smaller responses are not worth compressing
+MIN_COMPRESS_SIZE = 1024
+# Seconds between two checks whether a cached file changed on disk
+CHECK_INTERVAL = 1.0
+
+
+class CachedFile:
+    """
+    A file held in memory together with its compressed variants.
+    Precompressed .br and .gz files next to it are used if present, otherwise it is gzipped on load.
+    The file is reloaded when its modification time or size changes.
+    Every variant has its own ETag, as a strong validator has to differ per encoding.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        self.last_modified = 0.0
+        # encoding -> body, "identity" is the file itself
+        self.variants: Dict[str, bytes] = {}
+        self.etags: Dict[str, str] = {}
+        self._version: Optional[Tuple[int, int]] = None
+        self._checked_at: Optional[float] = None
+
+    def _read_variant(self, extension: str, mtime: float) -> Optional[bytes]:
+        try:
+            if os.stat(self.path + extension).st_mtime < mtime:
+                # Left behind by an older build
+                return None
+            with open(self.path + extension, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _load(self, version: Tuple[int, int], mtime: float) -> None:
+        with open(self.path, "rb") as f:
+            data = f.read()
+        variants = {"identity": data}
+        if len(data) >= MIN_COMPRESS_SIZE:
+            brotli = self._read_variant(".br", mtime)
+            if brotli is not None:
+                variants["br"] = brotli
+            variants["gzip"] = self._read_variant(".gz", mtime) or gzip.compress(
+                data, 9
+            )
+        digest = hashlib.sha1(data).hexdigest()
+        self.variants = variants
+        self.etags = {encoding: f'"{digest}-{encoding}"' for encoding in variants}
+        self.etags["identity"] = f'"{digest}"'
+        self.last_modified = mtime
+        self._version = version
+
+    async def refresh(self) -> None:
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < CHECK_INTERVAL:
+            return
+        loop = asyncio.get_event_loop()
+        stat = await loop.run_in_executor(None, os.stat, self.path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        if version != self._version:
+            await loop.run_in_executor(None, self._load, version, stat.st_mtime)
+        self._checked_at = now
+
+    def response(self, request: web.Request, cache_control: str) -> web.Response:
+        accept_encoding = request.headers.get(hdrs.ACCEPT_ENCODING, "").lower()
+        encoding = "identity"
+        for candidate in ("br", "gzip"):
+            if candidate in self.variants and candidate in accept_encoding:
+                encoding = candidate
+                break
+        etag = self.etags[encoding]
+
+        headers = {
+            hdrs.CACHE_CONTROL: cache_control,
+            hdrs.ETAG: etag,
+            hdrs.VARY: hdrs.ACCEPT_ENCODING,
+        }
+        response = web.Response(headers=headers)
+        response.last_modified = self.last_modified
+        if_none_match = request.headers.get(hdrs.IF_NONE_MATCH, None)
+        if if_none_match is not None:
+            not_modified = if_none_match.strip() == "*" or etag in (
+                tag.strip() for tag in if_none_match.split(",")
+            )
+        else:
+            since = request.if_modified_since
+            not_modified = (
+                since is not None and since.timestamp() >= int(self.last_modified)
+            )
+        if not_modified:
+            response.set_status(304)
+            return response
+
+        if encoding != "identity":
+            response.headers[hdrs.CONTENT_ENCODING] = encoding
+        response.body = self.variants[encoding]
+        response.content_type = self.content_type
+        return response
+
+
+_file_cache: Dict[str, CachedFile] = {}
+
+
+async def _get_cached(path: str) -> CachedFile:
+    cached = _file_cache.get(path, None)
+    if cached is None:
+        cached = CachedFile(path)
+    try:
+        await cached.refresh()
+    except FileNotFoundError:
+        _file_cache.pop(path, None)
+        raise web.HTTPNotFound()
+    _file_cache[path] = cached
+    return cached
+
+
 async def root(request):
-    return web.FileResponse("./templates/index.html")
-    # return {}
+    """
+    The client is a single page app, every route that is not handled elsewhere gets the same index.
+    """
+    index = await _get_cached("./templates/index.html")
+    return index.response(request, "no-cache")
+
+
+async def serve_bundle(request):
+    """
+    Serve the js and css files of the client from memory, compressed when the client supports it.
+    """
+    name = request.match_info["name"]
+    if name.startswith("."):
+        raise web.HTTPNotFound()
+    cached = await _get_cached(
+        os.path.join("static", request.match_info["kind"], name)
+    )
+    if HASHED_NAME_RE.match(name):
+        return cached.response(request, "public, max-age=31536000, immutable")
+    return cached.response(request, "no-cache")
 
 
 async def root_dev(request):
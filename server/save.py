@@ -3,7 +3,9 @@ import logging
 import os
 import secrets
 import shutil
+import struct
 import sys
+import time
 
 from peewee import (
     BooleanField,
@@ -15,11 +17,15 @@ from peewee import (
 )
 from playhouse.migrate import fn, migrate, SqliteMigrator
 
+import backup
 from config import SAVE_FILE
 from models import ALL_MODELS, Constants
 from models.db import db
 
-SAVE_VERSION = 27
+SAVE_VERSION = 34
+# Upgrades that can not run inside a transaction (e.g. because they VACUUM)
+# or that change files on disk, which a rollback of the batch would not undo.
+NON_TRANSACTIONAL_UPGRADES = {28, 31}
 
 logger: logging.Logger = logging.getLogger("PlanarAllyServer")
 logger.setLevel(logging.INFO)
@@ -366,10 +372,203 @@ def upgrade(version):
 
         db.foreign_keys = True
         Constants.get().update(save_version=Constants.save_version + 1).execute()
+    elif version == 27:
+        # Store Polygon.vertices as packed little-endian float64 pairs instead of a json string
+        db.foreign_keys = False
+        with db.atomic():
+            db.execute_sql("CREATE TEMPORARY TABLE _polygon AS SELECT * FROM polygon")
+            db.execute_sql("DROP TABLE polygon")
+            db.execute_sql(
+                'CREATE TABLE IF NOT EXISTS "polygon" ("shape_id" TEXT NOT NULL PRIMARY KEY, "vertices" BLOB NOT NULL, "line_width" INTEGER NOT NULL, "open_polygon" INTEGER NOT NULL, FOREIGN KEY ("shape_id") REFERENCES "shape" ("uuid") ON DELETE CASCADE)'
+            )
+            cursor = db.execute_sql(
+                "SELECT shape_id, vertices, line_width, open_polygon FROM _polygon"
+            )
+            while True:
+                rows = cursor.fetchmany(500)
+                if not rows:
+                    break
+                packed = []
+                for shape_id, vertices, line_width, open_polygon in rows:
+                    points = [
+                        c
+                        for p in json.loads(vertices)
+                        # Stored as {x, y} objects, [x, y] pairs are accepted too
+                        for c in ((p["x"], p["y"]) if isinstance(p, dict) else p)
+                    ]
+                    packed.append(
+                        (
+                            shape_id,
+                            struct.pack(f"<{len(points)}d", *points),
+                            line_width,
+                            open_polygon,
+                        )
+                    )
+                db.cursor().executemany(
+                    "INSERT INTO polygon (shape_id, vertices, line_width, open_polygon) VALUES (?, ?, ?, ?)",
+                    packed,
+                )
+            db.execute_sql("DROP TABLE _polygon")
+        db.foreign_keys = True
+        Constants.get().update(save_version=Constants.save_version + 1).execute()
+    elif version == 28:
+        # Enable incremental auto vacuum, this requires a full VACUUM to take effect
+        if db.execute_sql("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            db.execute_sql("PRAGMA auto_vacuum = INCREMENTAL")
+            db.execute_sql("VACUUM")
+        Constants.get().update(save_version=Constants.save_version + 1).execute()
+    elif version == 29:
+        # Add a materialized path to assets so folders can be looked up by path directly
+        migrator = SqliteMigrator(db)
+        migrate(
+            migrator.add_column("asset", "path", TextField(default="")),
+            migrator.add_index("asset", ("owner_id", "path"), False),
+        )
+        children = {}
+        for asset_id, parent_id, name in db.execute_sql(
+            "SELECT id, parent_id, name FROM asset"
+        ):
+            children.setdefault(parent_id, []).append((asset_id, name))
+        paths = []
+        todo = [(asset_id, "/") for asset_id, _ in children.get(None, [])]
+        while todo:
+            asset_id, path = todo.pop()
+            paths.append((path, asset_id))
+            for child_id, name in children.get(asset_id, []):
+                todo.append((child_id, f"{path.rstrip('/')}/{name}"))
+        db.cursor().executemany("UPDATE asset SET path = ? WHERE id = ?", paths)
+        Constants.get().update(save_version=Constants.save_version + 1).execute()
+    elif version == 30:
+        # Reference count asset files so unused files can be removed in the background
+        db.execute_sql(
+            'CREATE TABLE IF NOT EXISTS "asset_file" ("file_hash" TEXT NOT NULL PRIMARY KEY, "references" INTEGER NOT NULL, "released_at" REAL)'
+        )
+        db.execute_sql(
+            'INSERT INTO "asset_file" ("file_hash", "references") SELECT "file_hash", COUNT(*) FROM "asset" WHERE "file_hash" IS NOT NULL GROUP BY "file_hash"'
+        )
+        Constants.get().update(save_version=Constants.save_version + 1).execute()
+    elif version == 31:
+        # Move asset files from a flat directory to the ab/cd/<hash> layout
+        # Derivatives and tiles are regenerated on demand in the new layout
+        # Files in the new layout are skipped, so this can safely run again after a failure
+        from derivatives import DERIVATIVES_DIR, TILES_DIR
+        from utils import ASSETS_DIR, get_asset_path
+
+        if ASSETS_DIR.exists():
+            moved = 0
+            for path in ASSETS_DIR.iterdir():
+                # <sha1 hash> and precompressed <sha1 hash>.gz/.br files
+                file_hash = path.name.split(".")[0]
+                if not path.is_file() or len(file_hash) != 40:
+                    continue
+                target = get_asset_path(file_hash)
+                target.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(path, target.parent / path.name)
+                moved += 1
+            logger.warning(f"Moved {moved} asset files")
+            shutil.rmtree(DERIVATIVES_DIR, ignore_errors=True)
+            shutil.rmtree(TILES_DIR, ignore_errors=True)
+        Constants.get().update(save_version=Constants.save_version + 1).execute()
+    elif version == 32:
+        # Usage counters that storage quotas are checked against
+        from models.asset import get_file_size
+
+        migrator = SqliteMigrator(db)
+        migrate(
+            migrator.add_column("asset_file", "size", IntegerField(default=0)),
+            migrator.add_column("user", "asset_bytes", IntegerField(default=0)),
+            migrator.add_column("room", "shape_count", IntegerField(default=0)),
+        )
+        db.cursor().executemany(
+            "UPDATE asset_file SET size = ? WHERE file_hash = ?",
+            [
+                (get_file_size(file_hash), file_hash)
+                for (file_hash,) in db.execute_sql("SELECT file_hash FROM asset_file")
+            ],
+        )
+        db.execute_sql(
+            'UPDATE "user" SET asset_bytes = (SELECT COALESCE(SUM(f.size), 0) FROM asset a JOIN asset_file f ON f.file_hash = a.file_hash WHERE a.owner_id = "user".id)'
+        )
+        db.execute_sql(
+            "UPDATE room SET shape_count = (SELECT COUNT(*) FROM shape s JOIN layer l ON s.layer_id = l.id JOIN floor f ON l.floor_id = f.id JOIN location lo ON f.location_id = lo.id WHERE lo.room_id = room.id)"
+        )
+        Constants.get().update(save_version=Constants.save_version + 1).execute()
+    elif version == 33:
+        # Look up users by an indexed lowercase name instead of scanning with lower()
+        migrator = SqliteMigrator(db)
+        migrate(
+            migrator.add_column("user", "normalized_name", TextField(null=True))
+        )
+        names = {}
+        for user_id, name in db.execute_sql('SELECT id, name FROM "user" ORDER BY id'):
+            # Names that only differ in case were already shadowed by the oldest user
+            if name.lower() in names:
+                logger.warning(f"User {name} has the same name as an older user")
+                continue
+            names[name.lower()] = user_id
+        db.cursor().executemany(
+            'UPDATE "user" SET normalized_name = ? WHERE id = ?', names.items()
+        )
+        migrate(migrator.add_index("user", ("normalized_name",), True))
+        Constants.get().update(save_version=Constants.save_version + 1).execute()
     else:
         raise Exception(f"No upgrade code for save format {version} was found.")
 
 
+def run_upgrade(version: int, step: int, total: int):
+    logger.warning(f"[{step}/{total}] Starting upgrade to {version + 1}")
+    start = time.perf_counter()
+    upgrade(version)
+    logger.warning(
+        f"[{step}/{total}] Upgrade to {version + 1} done in {time.perf_counter() - start:.2f}s"
+    )
+
+
+def upgrade_save(version: int):
+    """
+    Upgrade the save file from `version` to SAVE_VERSION.
+    A single backup is taken up front and consecutive upgrades share one transaction.
+    If an upgrade fails, the save is left at the version before the failing transaction.
+    """
+    start = time.perf_counter()
+    logger.warning(f"Backing up old save as {SAVE_FILE}.{version}")
+    if backup.SUPPORTED:
+        backup.backup(f"{SAVE_FILE}.{version}")
+    else:
+        # Nothing else uses the save file yet
+        shutil.copyfile(SAVE_FILE, f"{SAVE_FILE}.{version}")
+    logger.warning(f"Backup done in {time.perf_counter() - start:.2f}s")
+
+    total = abs(SAVE_VERSION - version)
+    step = 1
+    # Foreign keys can only be toggled outside of a transaction
+    db.foreign_keys = False
+    try:
+        while version != SAVE_VERSION:
+            if version in NON_TRANSACTIONAL_UPGRADES:
+                run_upgrade(version, step, total)
+                version += 1
+                step += 1
+                continue
+            with db.atomic():
+                while (
+                    version != SAVE_VERSION
+                    and version not in NON_TRANSACTIONAL_UPGRADES
+                ):
+                    run_upgrade(version, step, total)
+                    version += 1
+                    step += 1
+    except Exception as e:
+        logger.exception(e)
+        logger.error("ERROR: Could not start server")
+        sys.exit(2)
+    finally:
+        db.foreign_keys = True
+    logger.warning(
+        f"Upgrade process completed successfully in {time.perf_counter() - start:.2f}s."
+    )
+
+
 def check_save():
     if not os.path.isfile(SAVE_FILE):
         logger.warning("Provided save file does not exist.  Creating a new one.")
@@ -389,25 +588,4 @@ def check_save():
                 f"Save format {constants.save_version} does not match the required version {SAVE_VERSION}!"
             )
             logger.warning("Attempting upgrade")
-
-        updated = False
-        while constants.save_version != SAVE_VERSION:
-            updated = True
-            logger.warning(
-                f"Backing up old save as {SAVE_FILE}.{constants.save_version}"
-            )
-            shutil.copyfile(SAVE_FILE, f"{SAVE_FILE}.{constants.save_version}")
-            logger.warning(f"Starting upgrade to {constants.save_version + 1}")
-            try:
-                upgrade(constants.save_version)
-            except Exception as e:
-                logger.exception(e)
-                logger.error("ERROR: Could not start server")
-                sys.exit(2)
-                break
-            else:
-                logger.warning(f"Upgrade to {constants.save_version + 1} done.")
-                constants = Constants.get()
-        else:
-            if updated:
-                logger.warning("Upgrade process completed successfully.")
+            upgrade_save(constants.save_version)
@@ -1,6 +1,7 @@
 from abc import ABC, abstractmethod
 from typing import Any, Dict, Generator, Generic, Set, Tuple, TypeVar
 
+import ratelimit
 from app import sio
 from models import User
 
@@ -17,6 +18,7 @@ class State(ABC, Generic[T]):
 
     async def remove_sid(self, sid: int) -> None:
         del self._sid_map[sid]
+        ratelimit.forget(sid)
 
     def has_sid(self, sid: int) -> bool:
         return sid in self._sid_map
@@ -1,14 +1,17 @@
-from typing import Any, Dict
-
 from . import State
 from app import app
 from models import User
+from uploads import UploadManager
 
 
 class AssetState(State[User]):
     def __init__(self) -> None:
         super().__init__()
-        self.pending_file_upload_cache: Dict[str, Any] = {}
+        self.uploads = UploadManager()
+
+    async def remove_sid(self, sid: int) -> None:
+        await self.uploads.remove_sid(sid)
+        await super().remove_sid(sid)
 
     def get_user(self, sid: int) -> User:
         return self._sid_map[sid]
@@ -0,0 +1,29 @@
+from peewee import SqliteDatabase
+
+from models import ALL_MODELS, Polygon
+from models.shape import pack_points, unpack_points
+
+# The format the client sends and expects
+VERTICES = [{"x": 1.5, "y": -2.0}, {"x": 10000.25, "y": 0.0}, {"x": -3.0, "y": 7.75}]
+
+
+def test_pack_round_trip():
+    assert unpack_points(pack_points(VERTICES)) == VERTICES
+    assert unpack_points(pack_points([])) == []
+
+
+def test_polygon_round_trip():
+    database = SqliteDatabase(":memory:")
+    with database.bind_ctx(ALL_MODELS):
+        database.create_tables([Polygon])
+        Polygon.create(
+            shape="polygon", vertices=VERTICES, line_width=2, open_polygon=False
+        )
+        polygon = Polygon.get(Polygon.shape == "polygon")
+        assert polygon.as_dict(exclude=[Polygon.shape])["vertices"] == VERTICES
+
+        moved = [{"x": p["x"] + 1, "y": p["y"]} for p in VERTICES]
+        polygon.update_from_dict({"vertices": moved})
+        polygon.save()
+        polygon = Polygon.get(Polygon.shape == "polygon")
+        assert polygon.as_dict(exclude=[Polygon.shape])["vertices"] == moved
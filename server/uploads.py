@@ -0,0 +1,456 @@
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+import uuid as uuidlib
+from pathlib import Path
+from typing import Any, Dict, Optional, Set
+
+import derivatives
+from config import config
+from utils import ASSETS_DIR, get_asset_path
+
+logger = logging.getLogger("PlanarAllyServer")
+
+# Partial uploads live next to the assets so they can be atomically renamed into place.
+UPLOAD_DIR = ASSETS_DIR / ".uploads"
+
+# Slice size used by clients that do not send one along.
+DEFAULT_CHUNK_SIZE = 100_000
+
+# Seconds after which an upload that received no new slices is discarded.
+UPLOAD_TTL = config.getint("Uploads", "ttl", fallback=600)
+# Combined size of all unfinished uploads.
+UPLOAD_BUDGET = config.getint("Uploads", "max_pending_mb", fallback=512) * 1024 * 1024
+
+
+class Upload:
+    """
+    Base class for a file that is being uploaded to a temporary file.
+
+    The sha1 is updated incrementally while the data arrives,
+    so memory usage does not depend on the file size.
+    All disk and hashing work runs in the default executor and is serialized by a thread lock,
+    which keeps the file consistent even if the awaiting request gets cancelled.
+    """
+
+    def __init__(self, uuid: str, size: Optional[int] = None, sid: Any = None) -> None:
+        self.uuid = uuid
+        self.sid = sid
+        self.size = size
+        # The client uuid is not trusted as a file name
+        self.path = UPLOAD_DIR / uuidlib.uuid4().hex
+        self.received_bytes = 0
+        self.last_activity = time.monotonic()
+        self._sha = hashlib.sha1()
+        self._file = None
+        self._lock = threading.Lock()
+        # Set once the upload is discarded, work that was queued before is refused
+        self._discarded = False
+
+    @property
+    def reserved_bytes(self) -> int:
+        # The declared size is not trusted to be an upper bound
+        return max(self.size or 0, self.received_bytes)
+
+    def _open(self) -> None:
+        if self._file is None:
+            UPLOAD_DIR.mkdir(exist_ok=True)
+            self._file = open(self.path, "w+b")
+            if self.size is not None:
+                # Pre-size (sparse) so out of order data can be written at its offset
+                self._file.truncate(self.size)
+
+    def _check_discarded(self) -> None:
+        if self._discarded:
+            raise UploadRejected("The upload was cancelled, try again.")
+
+    def _finish(self) -> str:
+        with self._lock:
+            self._check_discarded()
+            self._open()
+            self._file.close()
+            file_hash = self._sha.hexdigest()
+            store_file(self.path, file_hash)
+            return file_hash
+
+    def _close(self) -> Path:
+        with self._lock:
+            self._check_discarded()
+            self._open()
+            self._file.close()
+            return self.path
+
+    def _discard(self) -> None:
+        with self._lock:
+            self._discarded = True
+            if self._file is not None:
+                self._file.close()
+                if self.path.exists():
+                    self.path.unlink()
+
+    async def _run(self, fn, *args):
+        self.last_activity = time.monotonic()
+        return await asyncio.get_event_loop().run_in_executor(None, fn, *args)
+
+    async def finish(self) -> str:
+        """
+        Move the completed upload into the asset store and return its hash.
+        """
+        return await self._run(self._finish)
+
+    async def close(self) -> Path:
+        """
+        Close the completed upload and return the path of the temporary file.
+        """
+        return await self._run(self._close)
+
+    async def discard(self) -> None:
+        await self._run(self._discard)
+
+
+def claim_existing(file_hash: str) -> bool:
+    """
+    Whether a file with this hash is already stored, so it does not need to be uploaded again.
+    """
+    target = get_asset_path(file_hash)
+    if not target.exists():
+        return False
+    # Keeps the asset garbage collector from removing the file
+    os.utime(target)
+    return True
+
+
+def store_file(path: Path, file_hash: str) -> None:
+    """
+    Move a file into the asset store, unless the same content is already stored.
+    """
+    if claim_existing(file_hash):
+        path.unlink()
+    else:
+        target = get_asset_path(file_hash)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(path, target)
+
+
+class PendingUpload(Upload):
+    """
+    A file that is being uploaded in slices over the asset manager socket.
+
+    Every slice is written to its offset as soon as it arrives.
+    The hash covers the contiguous prefix of received slices and catches up
+    on out of order slices by reading them back from disk.
+    """
+
+    def __init__(
+        self,
+        uuid: str,
+        sid: Any,
+        total_slices: int,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        size: Optional[int] = None,
+    ) -> None:
+        super().__init__(uuid, size, sid)
+        self.total_slices = total_slices
+        self.chunk_size = chunk_size
+        self.received: Set[int] = set()
+        self.hashed_slices = 0
+
+    @property
+    def complete(self) -> bool:
+        return len(self.received) == self.total_slices
+
+    def valid_slice(self, slice_: Any, data: Any) -> bool:
+        """
+        Whether the slice lies within the upload and has the length its position requires.
+        Every slice but the last fills a whole chunk, so the file matches the data that is hashed.
+        """
+        for value, type_ in [
+            (self.total_slices, int),
+            (self.chunk_size, int),
+            (slice_, int),
+            (data, bytes),
+        ]:
+            if not isinstance(value, type_):
+                return False
+        if self.size is not None and (not isinstance(self.size, int) or self.size < 0):
+            return False
+        if not 0 <= slice_ < self.total_slices:
+            return False
+        if self.size is not None:
+            # A declared size is exact, the file is pre-sized to it
+            end = slice_ * self.chunk_size + len(data)
+            last = slice_ == self.total_slices - 1
+            if end > self.size or (last and end != self.size):
+                return False
+        if slice_ < self.total_slices - 1:
+            return len(data) == self.chunk_size
+        return 0 < len(data) <= self.chunk_size
+
+    def _finish(self) -> str:
+        if self.hashed_slices != self.total_slices:
+            raise UploadRejected("The upload is incomplete, try again.")
+        return super()._finish()
+
+    def _write(self, slice_: int, data: bytes) -> bool:
+        with self._lock:
+            self._check_discarded()
+            if slice_ in self.received or self.complete:
+                return False
+            self._open()
+            self._file.seek(slice_ * self.chunk_size)
+            self._file.write(data)
+            self.received.add(slice_)
+            self.received_bytes += len(data)
+
+            if slice_ == self.hashed_slices:
+                self._sha.update(data)
+                self.hashed_slices += 1
+            # Catch up on slices that arrived before this one
+            while self.hashed_slices in self.received:
+                self._file.seek(self.hashed_slices * self.chunk_size)
+                self._sha.update(self._file.read(self.chunk_size))
+                self.hashed_slices += 1
+            return self.complete
+
+    async def add_slice(self, slice_: int, data: bytes) -> bool:
+        """
+        Store a slice of the upload.
+        Returns True for the call that received the last missing slice.
+        Raises UploadRejected if the upload was discarded in the meantime.
+        """
+        return await self._run(self._write, slice_, data)
+
+
+class ResumableUpload(Upload):
+    """
+    A file that is uploaded over http in sequential chunks.
+
+    Data is only accepted at the current offset, after an interrupted request
+    the client asks for the offset and continues from there.
+    """
+
+    def __init__(
+        self, owner: int, name: str, directory: int, size: int, archive=False
+    ) -> None:
+        super().__init__(uuidlib.uuid4().hex, size)
+        self.owner = owner
+        self.name = name
+        self.directory = directory
+        # Archives are imported as a folder instead of being stored as an asset
+        self.archive = archive
+
+    @property
+    def offset(self) -> int:
+        return self.received_bytes
+
+    @property
+    def complete(self) -> bool:
+        return self.received_bytes == self.size
+
+    def _append(self, offset: int, data: bytes) -> bool:
+        with self._lock:
+            self._check_discarded()
+            if offset != self.received_bytes or offset + len(data) > self.size:
+                return False
+            self._open()
+            self._file.seek(offset)
+            self._file.write(data)
+            self._sha.update(data)
+            self.received_bytes += len(data)
+            return True
+
+    async def append(self, offset: int, data: bytes) -> bool:
+        """
+        Append data at `offset`, returns False if offset is not the end of the received data.
+        Raises UploadRejected if the upload was discarded in the meantime.
+        """
+        return await self._run(self._append, offset, data)
+
+
+class UploadRejected(Exception):
+    pass
+
+
+class UploadManager:
+    """
+    Keeps track of all unfinished uploads.
+
+    Uploads are discarded when they receive no slices for UPLOAD_TTL seconds,
+    when their socket disconnects or when they would exceed UPLOAD_BUDGET.
+    """
+
+    def __init__(self) -> None:
+        self._uploads: Dict[str, Upload] = {}
+        # Uploads that were rejected, their remaining slices are ignored
+        self._rejected: Dict[str, float] = {}
+
+    @property
+    def usage(self) -> int:
+        return sum(upload.reserved_bytes for upload in self._uploads.values())
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "uploads": len(self._uploads),
+            "bytes": self.usage,
+            "budget": UPLOAD_BUDGET,
+        }
+
+    def _fits(self, upload: Upload, data: bytes = b"") -> bool:
+        extra = max(upload.received_bytes + len(data) - upload.reserved_bytes, 0)
+        return self.usage + extra <= UPLOAD_BUDGET
+
+    def get(self, uuid: str) -> Optional[Upload]:
+        return self._uploads.get(uuid, None)
+
+    def is_new(self, uuid: str) -> bool:
+        return uuid not in self._uploads and uuid not in self._rejected
+
+    def reject(self, uuid: str) -> None:
+        """
+        Ignore all further slices of a socket upload.
+        """
+        self._rejected[uuid] = time.monotonic()
+
+    async def create_resumable(
+        self, owner: int, name: str, directory: int, size: int, archive=False
+    ) -> ResumableUpload:
+        """
+        Register a new http upload.
+        Raises UploadRejected if the upload does not fit in the budget.
+        """
+        upload = ResumableUpload(owner, name, directory, size, archive)
+        self._uploads[upload.uuid] = upload
+        if not self._fits(upload):
+            await self.remove_expired()
+        if not self._fits(upload):
+            await self.discard(upload)
+            logger.warning(
+                f"Rejected upload {name}, pending uploads would exceed {UPLOAD_BUDGET} bytes"
+            )
+            raise UploadRejected(
+                "The server is busy with other uploads, try again later."
+            )
+        return upload
+
+    def claim(self, upload: Upload) -> bool:
+        """
+        Stop tracking a completed upload so the caller can finish or take it.
+        Returns False if it was already claimed by another request or discarded.
+        """
+        return self._uploads.pop(upload.uuid, None) is upload
+
+    async def finish(self, upload: Upload) -> str:
+        """
+        Move a completed upload into the asset store and return its hash.
+        """
+        self._uploads.pop(upload.uuid, None)
+        try:
+            file_hash = await upload.finish()
+        except UploadRejected:
+            await upload.discard()
+            raise
+        # Large maps get a tile pyramid so clients can load only what is in view
+        derivatives.schedule_tiles(file_hash)
+        return file_hash
+
+    async def take(self, upload: Upload) -> Path:
+        """
+        Stop tracking a completed upload and return its temporary file, which the caller now owns.
+        """
+        self._uploads.pop(upload.uuid, None)
+        return await upload.close()
+
+    async def add_slice(self, sid, file_data) -> Optional[PendingUpload]:
+        """
+        Store a slice of an upload.
+        Returns the upload once all of its slices have arrived.
+        Raises UploadRejected if the upload does not fit in the budget.
+        """
+        uuid = file_data["uuid"]
+        if uuid in self._rejected:
+            return None
+
+        upload = self._uploads.get(uuid, None)
+        if upload is None:
+            upload = PendingUpload(
+                uuid,
+                sid,
+                file_data["totalSlices"],
+                file_data.get("chunkSize", DEFAULT_CHUNK_SIZE),
+                file_data.get("size", None),
+            )
+        elif not isinstance(upload, PendingUpload) or upload.sid != sid:
+            return None
+
+        if not upload.valid_slice(file_data["slice"], file_data["data"]):
+            await self.discard(upload)
+            self._rejected[uuid] = time.monotonic()
+            logger.warning(f"Rejected upload {file_data['name']}, it has an invalid slice")
+            raise UploadRejected("The upload is corrupt, try again.")
+        # Only tracked once the slice is known to be valid, so its size can be counted
+        self._uploads[uuid] = upload
+
+        if not self._fits(upload, file_data["data"]):
+            await self.remove_expired()
+        if not self._fits(upload, file_data["data"]):
+            await self.discard(upload)
+            self._rejected[uuid] = time.monotonic()
+            logger.warning(
+                f"Rejected upload {file_data['name']}, pending uploads would exceed {UPLOAD_BUDGET} bytes"
+            )
+            raise UploadRejected(
+                "The server is busy with other uploads, try again later."
+            )
+
+        if await upload.add_slice(file_data["slice"], file_data["data"]):
+            return upload
+        return None
+
+    async def discard(self, upload: Upload) -> None:
+        self._uploads.pop(upload.uuid, None)
+        await upload.discard()
+
+    async def remove_sid(self, sid) -> None:
+        for upload in [
+            u for u in self._uploads.values() if sid is not None and u.sid == sid
+        ]:
+            logger.info(f"Discarding unfinished upload {upload.uuid} of {sid}")
+            await self.discard(upload)
+
+    async def remove_expired(self) -> None:
+        deadline = time.monotonic() - UPLOAD_TTL
+        for upload in [
+            u for u in self._uploads.values() if u.last_activity < deadline
+        ]:
+            logger.info(f"Discarding stale upload {upload.uuid}")
+            await self.discard(upload)
+        for uuid, rejected_at in list(self._rejected.items()):
+            if rejected_at < deadline:
+                del self._rejected[uuid]
+        if self._uploads:
+            stats = self.get_stats()
+            logger.info(
+                f"{stats['uploads']} pending uploads using {stats['bytes']} of {stats['budget']} bytes"
+            )
+
+    async def cleanup_loop(self) -> None:
+        while True:
+            await asyncio.sleep(60)
+            await self.remove_expired()
+
+
+async def start_upload_cleanup(app):
+    # Uploads do not survive a restart, remove whatever a previous run left behind
+    if UPLOAD_DIR.exists():
+        for path in UPLOAD_DIR.iterdir():
+            path.unlink()
+    app["upload_cleanup_task"] = asyncio.ensure_future(
+        app["state"]["asset"].uploads.cleanup_loop()
+    )
+
+
+async def stop_upload_cleanup(app):
+    app["upload_cleanup_task"].cancel()
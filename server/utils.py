@@ -15,3 +15,11 @@ def get_file_dir():
 
 
 FILE_DIR = get_file_dir()
+ASSETS_DIR = FILE_DIR / "static" / "assets"
+
+
+def get_asset_path(file_hash: str, root: Path = ASSETS_DIR) -> Path:
+    """
+    Location of a content addressed file, fanned out as ab/cd/<hash> to keep directories small.
+    """
+    return root / file_hash[:2] / file_hash[2:4] / file_hash